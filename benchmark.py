@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from flow_generator import SHAPES, generate_flow, write_flow
+from flow_parser import FlowParser
+from flow_plan import compile_plan, parse_steps, plan_path
+from flow_to_cwl_parser import FlowToCWLParser
+from local_engine import LocalEngine
+
+
+"""
+    Runs the function with the garbage collector disabled, so it does not
+    distort the measurements of large flows, and returns its runtime
+"""
+def timed(function):
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def bench_transform_nodes(flow_file_path, work_dir):
+    fp = FlowParser(flow_file_path)
+    return timed(fp.transform_nodes)
+
+
+def bench_parse_command(flow_file_path, work_dir):
+    return timed(lambda: FlowParser(flow_file_path).parse_command())
+
+
+def bench_create_workflow_files(flow_file_path, work_dir):
+    return timed(lambda: FlowToCWLParser(flow_file_path).create_workflow_files(output_dir=work_dir))
+
+
+def bench_create_packed_workflow(flow_file_path, work_dir):
+    return timed(lambda: FlowToCWLParser(flow_file_path).create_workflow_files(packed=True, output_dir=work_dir))
+
+
+"""
+    Loads the steps from the plan of the flow, which is compiled beforehand
+"""
+def bench_load_plan(flow_file_path, work_dir):
+    compile_plan(flow_file_path)
+    return timed(lambda: parse_steps(plan_path(flow_file_path)))
+
+
+"""
+    Executes the flow end to end with the LocalEngine, including parsing it
+"""
+def bench_local(flow_file_path, work_dir):
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+
+    def execute():
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            engine = LocalEngine(run_dir, flow_file_path)
+            engine.execute()
+        if engine.state.getState() != 'FINISHED':
+            raise RuntimeError(output.getvalue().strip().splitlines()[0])
+    return timed(execute)
+
+
+"""
+    Executes the flow end to end with the FireworkEngine on an in-memory
+    LaunchPad (mongomock), with one rocket for every CPU core
+"""
+def bench_fireworks(flow_file_path, work_dir):
+    from firework_engine import FireworkEngine
+    run_dir = tempfile.mkdtemp(dir=work_dir)
+
+    def execute():
+        cwd = os.getcwd()
+        # The rockets create their launcher directories in the current directory
+        os.chdir(run_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                engine = FireworkEngine(run_dir, flow_file_path, {}, rockets=os.cpu_count(), in_memory=True)
+                engine.execute('benchmark')
+        finally:
+            os.chdir(cwd)
+        if engine.state.getState() != 'FINISHED':
+            raise RuntimeError(output.getvalue().strip().splitlines()[0])
+    return timed(execute)
+
+
+BENCHMARKS = {
+    'transform_nodes': bench_transform_nodes,
+    'parse_command': bench_parse_command,
+    'create_workflow_files': bench_create_workflow_files,
+    'create_packed_workflow': bench_create_packed_workflow,
+    'load_plan': bench_load_plan,
+    'local': bench_local,
+    'fireworks': bench_fireworks
+}
+
+# FireWorks and mongomock are optional, so their benchmark only runs on request
+DEFAULT_BENCHMARKS = [name for name in BENCHMARKS if name != 'fireworks']
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+"""
+    Runs every benchmark on generated flows of every shape and size. Sizes above
+    the limit of a benchmark are left out (e.g. executing 100k processes), a
+    benchmark which fails is reported with its error instead of its timings.
+"""
+def run(benchmarks, shapes, sizes, repeat, limits):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'input.txt')
+        with open(input_path, 'w') as input_file:
+            input_file.writelines(f'{idx}\n' for idx in range(1000))
+
+        for shape in shapes:
+            for size in sizes:
+                flow_file_path = os.path.join(tmp_dir, f'{shape}_{size}.flow')
+                write_flow(flow_file_path, generate_flow(shape, size, input_path=input_path,
+                                                         output_path=os.path.join(tmp_dir, 'output.txt')))
+                for name in benchmarks:
+                    if size > limits.get(name, size):
+                        continue
+                    result = {'benchmark': name, 'shape': shape, 'nodes': size, 'repeat': repeat}
+                    try:
+                        timings = [BENCHMARKS[name](flow_file_path, tmp_dir) for _ in range(repeat)]
+                    except Exception as e:
+                        result['error'] = f'{type(e).__name__}: {e}'
+                        print(f'{name:>22} {shape:>6} {size:>8} nodes  failed: {result["error"][:80]}')
+                    else:
+                        seconds = min(timings)
+                        result.update({'seconds': seconds, 'median': statistics.median(timings),
+                                       'us_per_node': seconds / size * 1e6})
+                        print(f'{name:>22} {shape:>6} {size:>8} nodes  {seconds * 1000:10.2f} ms  '
+                              f'{seconds / size * 1e6:8.2f} us/node')
+                    results.append(result)
+
+    return {
+        'revision': git_revision(),
+        'time': time.time(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results
+    }
+
+
+"""
+    Prints the change of every benchmark compared to a previous report
+"""
+def compare(previous, current):
+    def key(result):
+        return (result['benchmark'], result['shape'], result['nodes'])
+
+    previous_results = {key(result): result for result in previous['results']}
+    for result in current['results']:
+        old = previous_results.get(key(result))
+        if old is None or 'seconds' not in old or 'seconds' not in result:
+            continue
+        ratio = result['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        print(f'{result["benchmark"]:>22} {result["shape"]:>6} {result["nodes"]:>8} nodes  '
+              f'{old["seconds"] * 1000:10.2f} ms -> {result["seconds"] * 1000:10.2f} ms  {ratio:6.2f}x')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the parsing and execution of generated *.flow-Files.')
+    parser.add_argument('-sizes', metavar='Sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000])
+    parser.add_argument('-shapes', metavar='Shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('-benchmarks', metavar='Benchmarks', nargs='+', choices=list(BENCHMARKS),
+                        default=DEFAULT_BENCHMARKS)
+    parser.add_argument('-repeat', metavar='Repeat', type=int, required=False, default=3)
+    parser.add_argument('-cwlmax', metavar='CWL Max Nodes', type=int, required=False, default=10000)
+    parser.add_argument('-execmax', metavar='Execution Max Nodes', type=int, required=False, default=1000)
+    parser.add_argument('-o', metavar='Report Path', required=False, default=None)
+    parser.add_argument('-compare', metavar='Previous Report', required=False, default=None)
+    args = parser.parse_args(argv)
+
+    report = run(args.benchmarks, args.shapes, args.sizes, args.repeat,
+                 {'create_workflow_files': args.cwlmax, 'create_packed_workflow': args.cwlmax,
+                  'local': args.execmax, 'fireworks': args.execmax})
+    if args.o != None:
+        with open(args.o, 'w') as report_file:
+            json.dump(report, report_file, indent=1)
+    if args.compare != None:
+        with open(args.compare) as report_file:
+            compare(json.load(report_file), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import time
+
+from step_runner import StepError, execute_step
+from step_store import changed_files, execute_incremental, file_state, files_size, snapshot
+from workflow_status import WorkFlowStatus, write_json_atomic
+
+
+"""
+    Per step checkpoints of a workflow run, stored as one file per step in
+    .workflow-checkpoints inside of the execution path. A checkpoint records
+    whether a step is RUNNING, COMPLETED or FAILED together with the files it
+    has written, so a failed run can be resumed at its first incomplete step
+    while reusing the outputs which have already been materialized.
+"""
+class Checkpoints:
+    def __init__(self, path):
+        self.checkpoint_dir = f'{path}/.workflow-checkpoints'
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def _checkpoint_path(self, name):
+        return os.path.join(self.checkpoint_dir, f'{name}.json')
+
+    def save(self, name, state, command=None, outputs=None):
+        write_json_atomic(self._checkpoint_path(name), {
+            'step': name, 'state': state, 'command': command,
+            'outputs': outputs or {}, 'time': time.time()
+        })
+
+    def load(self, name):
+        try:
+            with open(self._checkpoint_path(name)) as checkpoint_file:
+                return json.load(checkpoint_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load_all(self):
+        checkpoints = {}
+        for file_name in os.listdir(self.checkpoint_dir):
+            if file_name.endswith('.json'):
+                checkpoint = self.load(file_name[:-len('.json')])
+                if checkpoint is not None:
+                    checkpoints[checkpoint['step']] = checkpoint
+        return checkpoints
+
+    """
+        A step can be reused if it has completed with the same command and all
+        of the files it has written are still unchanged
+    """
+    def is_completed(self, name, command=None):
+        checkpoint = self.load(name)
+        if checkpoint is None or checkpoint['state'] != 'COMPLETED' or checkpoint['command'] != command:
+            return False
+        return all(file_state(path) == state for path, state in checkpoint['outputs'].items())
+
+    """
+        Removes all checkpoints, every step of the next run starts from scratch
+    """
+    def clear(self):
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+
+"""
+    Determines the steps of a run which can be reused when it is resumed.
+    A completed step is only reused if all the steps it depends on are reused
+    as well, otherwise its inputs are going to be written again.
+"""
+def reusable_steps(steps, checkpoints):
+    reusable = {}
+    for start in range(len(steps)):
+        # Iterative depth first search, flows can be too deep for recursion
+        stack = [start]
+        while stack:
+            idx = stack[-1]
+            if idx in reusable:
+                stack.pop()
+                continue
+            pending = [dep for dep in steps[idx]['depends_on'] if dep not in reusable]
+            if pending:
+                stack += pending
+                continue
+            stack.pop()
+            reusable[idx] = (all(reusable[dep] for dep in steps[idx]['depends_on']) and
+                             checkpoints.is_completed(f'task_{idx}', steps[idx]['command']))
+    return {idx for idx, is_reusable in reusable.items() if is_reusable}
+
+
+"""
+    Executes a step, writes its checkpoints and reports its progress to the
+    status of the workflow, used by the PyTask of a Firework. With cwd the step
+    is executed inside of it instead of the launch directory of the rocket.
+"""
+def execute_checkpointed(step, name, path, incremental=False, content_hash=False, cwd=None):
+    if cwd is not None:
+        os.chdir(cwd)
+    checkpoints = Checkpoints(path)
+    status = WorkFlowStatus(path)
+    before = snapshot(step)
+    checkpoints.save(name, 'RUNNING', step['command'])
+    status.stepStarted(name, step['command'])
+    try:
+        if incremental:
+            result = execute_incremental(step, path, content_hash)
+        else:
+            result = execute_step(step)
+    except Exception as e:
+        checkpoints.save(name, 'FAILED', step['command'])
+        status.stepFinished(name, e.returncode if isinstance(e, StepError) else 1)
+        raise
+    outputs = changed_files(step, before)
+    checkpoints.save(name, 'COMPLETED', step['command'], outputs)
+    status.stepFinished(name, 0, files_size(outputs), result.get('skipped', False), result.get('usage'))
+    return result
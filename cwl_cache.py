@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import time
+
+
+"""
+    Content addressed cache for the generated CWL tool and workflow files.
+    Every entry is a directory named after the key of the flow it has been
+    generated for (see flow_to_cwl_parser.definitions_cache_key). Entries are
+    written into a temporary directory first and then renamed, so a process never
+    sees an incomplete entry.
+    The modification time of an entry is updated on every hit and used to evict
+    the least recently used entries once the cache exceeds max_entries, as well
+    as all entries which have not been used for more than max_age seconds.
+"""
+class CWLCache:
+    def __init__(self, cache_dir, max_entries=64, max_age=7 * 24 * 3600):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_entries = max_entries
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def lookup(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            return None
+        return entry_dir
+
+    """
+        Creates a new entry, write_entry receives the directory the files of the
+        entry have to be written to
+    """
+    def store(self, key, write_entry):
+        entry_dir = os.path.join(self.cache_dir, key)
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            write_entry(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process has stored the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+        self.evict()
+        return entry_dir
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            try:
+                last_used = entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            # Temporary directories are only removed once they are stale
+            if entry.name.startswith('.tmp-'):
+                if now - last_used > self.max_age:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            entries.append((last_used, entry.path))
+
+        entries.sort(reverse=True)
+        for idx, (last_used, path) in enumerate(entries):
+            if idx >= self.max_entries or now - last_used > self.max_age:
+                shutil.rmtree(path, ignore_errors=True)
@@ -1,62 +1,213 @@
 import argparse
-import json
 import os
-from flow_to_cwl_parser import FlowToCWLParser
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from checkpoint import Checkpoints
+from cwl_cache import CWLCache
+from cwl_runner import STEP_LOG_RE, shared_runner
+from flow_to_cwl_parser import FlowToCWLParser, definitions_cache_key, read_cache_entry
+from tracing import Tracer
+from workflow_status import WorkFlowStatus
 
 
-class WorkFlowStatus:
-    def __init__(self, path):
-        self.file_path = f'{path}/.workflow-status.json'
-
-    def saveState(self, state):
-        with open(self.file_path, 'w') as out_file:
-            json.dump({'state': state}, out_file)
+"""
+    Process Engine executing the CWL files generated for a flow, either with an
+    external CWL runner (cwl_engine) or inside of this process with an
+    InProcessCWLRunner (runner). The in-process runner receives the workflow as a
+    document, no files are written for it. With packed, the external runner
+    receives a single document containing the workflow and all of its tools.
+    With fuse, chains of tools connected through stdout/stdin are executed as a
+    single step, which streams the data between them through pipes.
+    Without step_cache, the runner is not given a step cache (for runners which
+    do not accept --cachedir), so resume and incremental execute every step.
+"""
+class CWLEngine:
+    def __init__(self, output_path, input_file_path, cwl_engine, cache=None, incremental=False, tracer=None,
+                 runner=None, packed=False, fuse=False, step_cache=True):
+        self.state = WorkFlowStatus(output_path)
+        self.tracer = tracer or Tracer('cwl', enabled=False)
+        self.input_file_path = input_file_path
+        self.fuse = fuse
+        # Only created once the flow has to be parsed, see parser
+        self.cwl_parser = None
+        self.cwl_engine = cwl_engine
+        self.runner = runner
+        self.packed = packed
+        self.cache = cache
+        self.incremental = incremental
+        self.checkpoints = Checkpoints(output_path)
+        # The outputs of all steps are kept by the CWL runner itself, with --resume or -i
+        # it only runs the steps whose command line or input files have changed
+        self.step_cache = step_cache
+        self.step_cache_dir = f'{os.path.abspath(output_path)}/.cwl-step-cache'
+        # Time the runner has logged the start of each running step
+        self.step_starts = {}
+        self.step_results = []
 
-        return True
+    """
+        The flow is parsed when it is needed first, a hit of the CWL cache does not parse it at all
+    """
+    def parser(self):
+        if self.cwl_parser is None:
+            self.cwl_parser = FlowToCWLParser(self.input_file_path, self.tracer, self.fuse)
+        return self.cwl_parser
 
-    def getState(self):
-        state = None
-        with open(self.file_path) as json_file:
-            state = json.load(json_file)
-        return state['state']
+    """
+        Takes the CWL files of the flow from the CWL cache. The key of the cache is
+        known without parsing the flow, which is only parsed and generated on a miss.
+        Returns the workflow, the parameter file and the steps of the flow.
+    """
+    def cached_workflow_files(self):
+        with self.tracer.phase('cwl_cache') as args:
+            key = definitions_cache_key(self.input_file_path, self.fuse, self.packed)
+            entry_dir = self.cache.lookup(key)
+            args['hit'] = entry_dir is not None
+            if entry_dir is None:
+                entry_dir = self.cache.store(key, lambda entry_dir: self.parser().write_cache_entry(entry_dir,
+                                                                                                   self.packed))
+            return read_cache_entry(entry_dir, self.packed)
 
+    """
+        Writes the checkpoint of a step and reports its progress whenever the
+        runner logs its start or end
+    """
+    def checkpoint_from_log(self, line):
+        match = STEP_LOG_RE.search(line)
+        if match is None:
+            return
+        step_name, event, status = match.groups()
+        if event == 'start':
+            self.step_starts[step_name] = time.time()
+            self.checkpoints.save(step_name, 'RUNNING')
+            self.state.stepStarted(step_name)
+        else:
+            exit_code = 0 if status == 'success' else 1
+            self.checkpoints.save(step_name, 'COMPLETED' if exit_code == 0 else 'FAILED')
+            # The runner does not log exit codes or the outputs of its steps
+            self.state.stepFinished(step_name, exit_code)
+            start = self.step_starts.pop(step_name, None)
+            self.step_results.append({'step': step_name, 'status': status, 'returncode': exit_code,
+                                      'start': start, 'end': time.time()})
+            if start is not None:
+                self.tracer.step(step_name, start, time.time(), exit_code=exit_code)
 
-class CWLEngine:
-    def __init__(self, output_path, input_file_path, cwl_engine):
-        self.state = WorkFlowStatus(output_path)
-        self.cwl_parser = FlowToCWLParser(input_file_path)
-        self.cwl_engine = cwl_engine
+    """
+        The time until the runner logs the start of the first step is traced as
+        its startup, the steps are traced from its log
+    """
+    def run_external(self, wf_name, wf_param_name, cache_dir=None):
+        runner_args = shlex.split(self.cwl_engine)
+        # Not every runner accepts --cachedir, it is only passed when the cache is used
+        if cache_dir != None:
+            runner_args += ['--cachedir', cache_dir]
+        with self.tracer.phase('cwl_runner', runner=self.cwl_engine):
+            runner_start = time.time()
+            first_step = None
+            process = subprocess.Popen(runner_args + [wf_name, wf_param_name], stderr=subprocess.PIPE, text=True)
+            for line in process.stderr:
+                sys.stderr.write(line)
+                self.checkpoint_from_log(line)
+                if first_step is None and self.step_starts:
+                    first_step = min(self.step_starts.values())
+                    # Part of the cwl_runner phase, so it is not a phase of its own
+                    self.tracer.add_span('cwl_runner_startup', 'startup', runner_start, first_step)
+            process.wait()
+        if process.returncode != 0:
+            print(f'{self.cwl_engine} failed with exit code {process.returncode}')
+        return process.returncode
 
-    def execute(self):
-        wf_name, wf_param_name = self.cwl_parser.create_workflow_files()
+    def run_in_process(self, cache_dir=None):
+        workflow = self.cwl_parser.workflow_document()
+        with self.tracer.phase('cwl_in_process'):
+            result = self.runner.run(workflow, self.cwl_parser.job_order(), cache_dir=cache_dir,
+                                     on_step=self.checkpoint_from_log, key=self.cwl_parser.definitions_key())
+        if result['returncode'] != 0:
+            print(f'Workflow finished with status {result["status"]}')
+        return result['returncode']
 
+    """
+        When resuming, the runner reuses the outputs of all steps which have
+        completed in a previous run from its step cache. Any other run without
+        incremental starts with an empty step cache, so it executes every step.
+        Returns the exit code of the workflow together with the result of every step.
+    """
+    def execute(self, resume=False):
+        returncode = 1
+        self.step_results = []
         try:
-            self.state.saveState('READY')
-            self.state.saveState('RUNNING')
-            os.system(f'{self.cwl_engine} {wf_name} {wf_param_name}')
-            self.state.saveState('FINISHED')
+            if resume:
+                completed_steps = [name for name, checkpoint in self.checkpoints.load_all().items()
+                                   if checkpoint['state'] == 'COMPLETED']
+                print(f'Resuming after {len(completed_steps)} completed steps')
+            else:
+                self.checkpoints.clear()
+                if not self.incremental:
+                    shutil.rmtree(self.step_cache_dir, ignore_errors=True)
+
+            if self.runner is not None:
+                self.parser().compile()
+                steps = self.cwl_parser.steps
+            elif self.cache is not None:
+                wf_name, wf_param_name, steps = self.cached_workflow_files()
+            else:
+                wf_name, wf_param_name = self.parser().create_workflow_files(self.packed)
+                steps = self.cwl_parser.steps
+
+            # Steps reused from the step cache are logged by the runner as well
+            self.state.start(len(steps))
+            cache_dir = self.step_cache_dir if self.step_cache else None
+            if self.runner is not None:
+                returncode = self.run_in_process(cache_dir)
+            else:
+                returncode = self.run_external(wf_name, wf_param_name, cache_dir)
+            self.state.saveState('FINISHED' if returncode == 0 else 'ERROR')
         except Exception as e:
             print(e)
             self.state.saveState('ERROR')
+        return {'returncode': returncode, 'steps': self.step_results}
 
 
-parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('-p', metavar='Execution Path', required=True)
-parser.add_argument('-wf', metavar='Workflow Path',
-                    required=False, default=None)
-parser.add_argument('-s', metavar='Status', required=False, default=None)
-parser.add_argument('-en', metavar='CWL-Engine', required=False, default='cwl-runner')
-
-args = parser.parse_args()
-
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute *.flow-Files with a CWL runner.')
+    parser.add_argument('-p', metavar='Execution Path', required=True)
+    parser.add_argument('-wf', metavar='Workflow Path',
+                        required=False, default=None)
+    parser.add_argument('-s', metavar='Status', required=False, default=None,
+                        help='"summary" prints the progress of all steps, otherwise only the state')
+    parser.add_argument('-en', metavar='CWL-Engine', required=False, default='cwl-runner')
+    parser.add_argument('-cache', metavar='Cache Path', required=False, default=None)
+    parser.add_argument('-cachesize', metavar='Cache Entries', type=int, required=False, default=64)
+    parser.add_argument('-cacheage', metavar='Cache Age (hours)', type=float, required=False, default=168)
+    parser.add_argument('-i', '--incremental', action='store_true')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--inprocess', action='store_true')
+    parser.add_argument('--packed', action='store_true')
+    parser.add_argument('--fuse', action='store_true')
+    parser.add_argument('--no-step-cache', action='store_true')
+    parser.add_argument('--trace', metavar='Trace Path', required=False, default=None)
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], required=False, default='json')
+    args = parser.parse_args(argv)
 
-if __name__ == '__main__':
     # Execute Workflow / startCommand
     if args.wf != None:
-        cwl = CWLEngine(args.p, args.wf, args.en)
-        cwl.execute()
+        cache = None
+        if args.cache != None:
+            cache = CWLCache(args.cache, args.cachesize, args.cacheage * 3600)
+        tracer = Tracer('cwl', enabled=args.trace is not None)
+        runner = shared_runner() if args.inprocess else None
+        cwl = CWLEngine(args.p, args.wf, args.en, cache, args.incremental, tracer, runner, args.packed,
+                        args.fuse, not args.no_step_cache)
+        cwl.execute(args.resume)
+        if args.trace != None:
+            tracer.write(args.trace, args.trace_format)
     # Execute statusCommand
     elif args.s != None:
         ws = WorkFlowStatus(args.p)
-        print(ws.getState())
+        print(ws.describe() if args.s == 'summary' else ws.getState())
+
 
+if __name__ == '__main__':
+    main()
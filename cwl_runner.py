@@ -0,0 +1,162 @@
+import copy
+import logging
+import os
+import re
+import threading
+import time
+
+
+# Log messages of cwltool about the start and the end of a workflow step
+STEP_LOG_RE = re.compile(r'\[step (\S+)\] (start|completed (\w+))')
+
+
+"""
+    Forwards the step messages of the cwltool logger to a callback
+"""
+class StepLogHandler(logging.Handler):
+    def __init__(self, on_step):
+        super().__init__(logging.INFO)
+        self.on_step = on_step
+
+    def emit(self, record):
+        line = record.getMessage()
+        if STEP_LOG_RE.search(line):
+            self.on_step(line)
+
+
+"""
+    Executes CWL workflows inside of this process, with cwltool used as a library
+    instead of starting cwl-runner for every run. The interpreter, cwltool and the
+    CWL schemas are only loaded once, and loaded workflows are kept as long as
+    their file is unchanged (the files of a CWLCache entry never change), so a
+    further run of the same flow starts its first step right away.
+    Workflows and job orders can also be passed as documents, without any files
+    (see FlowToCWLParser.workflow_document), loaded documents are then kept by
+    the given key.
+    Independent steps of a workflow are executed in parallel.
+    cwltool (and PyYAML) are imported when the first runner is created.
+"""
+class InProcessCWLRunner:
+    def __init__(self, parallel=True, max_tools=64):
+        from cwltool.context import LoadingContext, RuntimeContext
+        from cwltool.executors import MultithreadedJobExecutor, SingleJobExecutor
+        from cwltool.load_tool import load_tool
+        from cwltool.utils import visit_class
+        from schema_salad.ref_resolver import file_uri
+        import yaml
+
+        self._runtime_context_class = RuntimeContext
+        self._load_tool = load_tool
+        self._visit_class = visit_class
+        self._file_uri = file_uri
+        self._safe_load = yaml.safe_load
+        self.loading_context = LoadingContext()
+        self.executor_class = MultithreadedJobExecutor if parallel else SingleJobExecutor
+        self.logger = logging.getLogger('cwltool')
+        # Loaded workflows, indexed by their path together with their size and
+        # modification time, least recently used first
+        self.tools = {}
+        self.max_tools = max_tools
+        self.lock = threading.Lock()
+
+    def load(self, workflow, key=None):
+        if isinstance(workflow, dict):
+            key = (f'#{key}',) if key is not None else None
+            document = workflow
+        else:
+            workflow = os.path.abspath(workflow)
+            stat = os.stat(workflow)
+            key = (workflow, stat.st_size, stat.st_mtime_ns)
+            document = self._file_uri(workflow)
+        with self.lock:
+            tool = self.tools.pop(key, None) if key is not None else None
+            if tool is None:
+                # Every workflow gets its own document loader, the schemas are shared.
+                # The loader annotates the document it is given, so it receives a copy.
+                tool = self._load_tool(copy.deepcopy(document), self.loading_context.copy())
+            if key is not None:
+                # A changed file replaces the workflow loaded from it before
+                for cached_key in [cached_key for cached_key in self.tools if cached_key[0] == key[0]]:
+                    del self.tools[cached_key]
+                self.tools[key] = tool
+                while len(self.tools) > self.max_tools:
+                    del self.tools[next(iter(self.tools))]
+        return tool
+
+    """
+        Reads the parameter file, the paths of files are resolved relative to it
+        the same way cwl-runner does. The paths of a given job order are resolved
+        relative to the current directory.
+    """
+    def job_order(self, params):
+        if isinstance(params, dict):
+            job_order = copy.deepcopy(params)
+            base_dir = os.getcwd()
+        else:
+            with open(params) as params_file:
+                job_order = self._safe_load(params_file) or {}
+            base_dir = os.path.dirname(os.path.abspath(params))
+
+        def path_to_location(file_object):
+            if 'path' in file_object and 'location' not in file_object:
+                file_object['location'] = self._file_uri(os.path.join(base_dir, file_object.pop('path')))
+        self._visit_class(job_order, ('File', 'Directory'), path_to_location)
+        return job_order
+
+    """
+        Executes the workflow and returns its status, its outputs and the result
+        of every step. on_step receives every log message about a step.
+        workflow and params are either paths or documents, a document is only
+        kept after the run if a key is given.
+    """
+    def run(self, workflow, params, output_dir='.', cache_dir=None, on_step=None, key=None):
+        steps = {}
+
+        def record_step(line):
+            step_name, event, status = STEP_LOG_RE.search(line).groups()
+            if event == 'start':
+                steps[step_name] = {'step': step_name, 'status': 'running', 'start': time.time(), 'end': None}
+            else:
+                steps.setdefault(step_name, {'step': step_name, 'start': None})
+                steps[step_name].update({'status': status, 'end': time.time()})
+            if on_step is not None:
+                on_step(line)
+
+        tool = self.load(workflow, key)
+        runtime_context = self._runtime_context_class()
+        runtime_context.outdir = os.path.abspath(output_dir)
+        if isinstance(params, str):
+            runtime_context.basedir = os.path.dirname(os.path.abspath(params))
+        else:
+            runtime_context.basedir = os.getcwd()
+        runtime_context.move_outputs = 'move'
+        if cache_dir is not None:
+            runtime_context.cachedir = cache_dir
+
+        handler = StepLogHandler(record_step)
+        self.logger.addHandler(handler)
+        try:
+            outputs, status = self.executor_class()(tool, self.job_order(params), runtime_context,
+                                                    logger=self.logger)
+        finally:
+            self.logger.removeHandler(handler)
+        return {
+            'status': status,
+            'returncode': 0 if status == 'success' else 1,
+            'outputs': outputs,
+            'steps': list(steps.values())
+        }
+
+
+_shared_runner = None
+
+
+"""
+    Runner shared by all CWLEngines of this process, so the loaded schemas
+    and workflows are reused between runs
+"""
+def shared_runner():
+    global _shared_runner
+    if _shared_runner is None:
+        _shared_runner = InProcessCWLRunner()
+    return _shared_runner
@@ -0,0 +1,241 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from step_runner import redirected_output
+from workflow_status import WorkFlowStatus
+
+
+FINAL_STATES = ('FINISHED', 'ERROR')
+
+# Warm state of a worker process, created once and reused for all of its runs
+_worker = {}
+
+
+"""
+    Initializer of every worker process. The engine is imported once and
+    everything which is expensive to set up is kept for all runs of the worker:
+    the connection to the LaunchPad, the CWL cache and the in-process CWL runner.
+"""
+def init_worker(engine, options):
+    _worker.update(engine=engine, options=options)
+    if engine == 'cwl':
+        from cwl_cache import CWLCache
+        from cwl_runner import shared_runner
+        if options.get('cache'):
+            _worker['cache'] = CWLCache(options['cache'])
+        if options.get('inprocess'):
+            _worker['runner'] = shared_runner()
+    elif engine == 'fireworks':
+        from firework_engine import connect_launchpad
+        # The worker itself is spawned, its rockets are forked from it so they
+        # share its LaunchPad (which may be an in-memory one) instead of reconnecting
+        multiprocessing.set_start_method('fork', force=True)
+        _worker['launchpad'] = connect_launchpad(options['db'], options.get('mongomock', False))
+
+
+"""
+    Executes a single run inside of a worker process. The run directory is the
+    working directory of the run, so relative paths of the flow (outputs, the
+    generated CWL files, ...) never collide with other runs. Everything the
+    engine and its steps print goes into engine.log inside of the run directory.
+"""
+def execute_run(run_id, flow_path, run_path):
+    engine = _worker['engine']
+    options = _worker['options']
+    os.chdir(run_path)
+    with redirected_output('engine.log'):
+        if engine == 'local':
+            from local_engine import LocalEngine
+            LocalEngine(run_path, flow_path, options.get('jobs'), shards=options.get('shards')).execute()
+        elif engine == 'cwl':
+            from cwl_engine import CWLEngine
+            # Runs of the daemon are never resumed, so the runner does not keep a step cache
+            CWLEngine(run_path, flow_path, options.get('cwl_engine', 'cwl-runner'), _worker.get('cache'),
+                      runner=_worker.get('runner'), packed=options.get('packed', False),
+                      fuse=options.get('fuse', False), step_cache=False).execute()
+        else:
+            from firework_engine import FireworkEngine
+            FireworkEngine(run_path, flow_path, options['db'], shards=options.get('shards'),
+                           launchpad=_worker['launchpad'], rockets=options.get('rockets', 1)).execute(run_id)
+    return WorkFlowStatus(run_path).getState()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.engine_daemon.handle(json.loads(line))
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+"""
+    Resident Process Engine accepting flows over a Unix socket. Every submitted
+    flow gets its own run directory inside of runs_path, holding its status,
+    its checkpoints and its outputs, and is executed on a pool of worker
+    processes, so many flows run at the same time without the cold start of
+    a new process per flow.
+    Requests and responses are single lines of JSON:
+        {"command": "submit", "flow": path} -> {"run_id": ..., "path": ...}
+        {"command": "status", "run_id": id} -> summary of the run
+        {"command": "runs"} -> all runs of the daemon
+        {"command": "shutdown"} -> stops accepting flows, running flows are finished
+"""
+class EngineDaemon:
+    def __init__(self, socket_path, runs_path, engine='local', options=None, workers=None):
+        self.socket_path = socket_path
+        self.runs_path = os.path.abspath(runs_path)
+        self.engine = engine
+        # Spawned workers do not inherit the threads of the socket server
+        self.pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_worker, initargs=(engine, options or {}))
+        self.runs = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    def submit(self, flow_path):
+        flow_path = os.path.abspath(flow_path)
+        if not os.path.isfile(flow_path):
+            raise FileNotFoundError(flow_path)
+        run_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        run_path = os.path.join(self.runs_path, run_id)
+        os.makedirs(run_path)
+        WorkFlowStatus(run_path).saveState('QUEUED')
+        run = {'run_id': run_id, 'flow': flow_path, 'path': run_path, 'submitted': time.time()}
+        with self.lock:
+            self.runs[run_id] = run
+        future = self.pool.submit(execute_run, run_id, flow_path, run_path)
+        future.add_done_callback(lambda future: self.finished(run, future))
+        return {'run_id': run_id, 'path': run_path}
+
+    """
+        A run whose worker has failed (e.g. the flow could not be parsed)
+        did not get the chance to report its error itself
+    """
+    def finished(self, run, future):
+        error = future.exception()
+        if error is not None:
+            run['error'] = f'{type(error).__name__}: {error}'
+            WorkFlowStatus(run['path']).saveState('ERROR')
+
+    def status(self, run_id):
+        with self.lock:
+            run = self.runs.get(run_id)
+        if run is None:
+            raise KeyError(f'Unknown run {run_id}')
+        return {**run, **WorkFlowStatus(run['path']).getSummary()}
+
+    def handle(self, request):
+        command = request.get('command')
+        if command == 'submit':
+            return self.submit(request['flow'])
+        if command == 'status':
+            return self.status(request['run_id'])
+        if command == 'runs':
+            with self.lock:
+                return {'runs': list(self.runs.values())}
+        if command == 'shutdown':
+            # Called from a thread of the server, so serve_forever can return
+            threading.Thread(target=self.server.shutdown).start()
+            return {'shutdown': True}
+        raise ValueError(f'Unknown command {command!r}')
+
+    def serve_forever(self):
+        os.makedirs(self.runs_path, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        self.server.daemon_threads = True
+        self.server.engine_daemon = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+            self.pool.shutdown(wait=True)
+
+
+"""
+    Sends a single request to the daemon listening on socket_path
+"""
+def request(socket_path, message):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps(message) + '\n').encode())
+        with client.makefile('rb') as response:
+            response = json.loads(response.readline())
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response
+
+
+"""
+    Submits a flow to the daemon, with wait the call returns once the run has finished
+"""
+def submit(socket_path, flow_path, wait=False, poll_interval=0.2):
+    run = request(socket_path, {'command': 'submit', 'flow': os.path.abspath(flow_path)})
+    while wait:
+        summary = request(socket_path, {'command': 'status', 'run_id': run['run_id']})
+        if summary['state'] in FINAL_STATES:
+            return summary
+        time.sleep(poll_interval)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute *.flow-Files submitted over a Unix socket.')
+    parser.add_argument('-socket', metavar='Socket Path', required=False, default='.process-engines.sock')
+    parser.add_argument('-runs', metavar='Runs Path', required=False, default='runs')
+    parser.add_argument('-e', '--engine', choices=['local', 'cwl', 'fireworks'], required=False, default='local')
+    parser.add_argument('-w', '--workers', metavar='Workers', type=int, required=False, default=None)
+    parser.add_argument('-j', '--jobs', metavar='Jobs', type=int, required=False, default=None)
+    parser.add_argument('--shards', metavar='Shards', type=int, required=False, default=None)
+    parser.add_argument('-en', metavar='CWL-Engine', required=False, default='cwl-runner')
+    parser.add_argument('-cache', metavar='Cache Path', required=False, default=None)
+    parser.add_argument('--inprocess', action='store_true')
+    parser.add_argument('--packed', action='store_true')
+    parser.add_argument('--fuse', action='store_true')
+    parser.add_argument('-r', '--rockets', metavar='Rockets', type=int, required=False, default=1)
+    parser.add_argument('--mongomock', action='store_true')
+    parser.add_argument('-dbhost', metavar='DB Host', required=False, default=None)
+    parser.add_argument('-dbport', metavar='DB Port', type=int, required=False, default=None)
+    parser.add_argument('-dbname', metavar='DB Name', required=False, default=None)
+    parser.add_argument('-dbusername', metavar='DB Username', required=False, default=None)
+    parser.add_argument('-dbpassword', metavar='DB Password', required=False, default=None)
+    args = parser.parse_args(argv)
+
+    options = {
+        'jobs': args.jobs,
+        'shards': args.shards,
+        'cwl_engine': args.en,
+        'cache': args.cache,
+        'inprocess': args.inprocess,
+        'packed': args.packed,
+        'fuse': args.fuse,
+        'rockets': args.rockets,
+        'mongomock': args.mongomock,
+        'db': {
+            "host": args.dbhost,
+            "port": args.dbport,
+            "name": args.dbname,
+            "username": args.dbusername,
+            "password": args.dbpassword
+        }
+    }
+    daemon = EngineDaemon(args.socket, args.runs, args.engine, options, args.workers)
+    print(f'Listening on {args.socket}, runs are written into {daemon.runs_path}')
+    daemon.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,77 +1,239 @@
 import argparse
-import json
+import importlib
+import os
+import time
 import uuid
-from fireworks import Firework, Workflow, FWorker, LaunchPad, ScriptTask
-from fireworks.core.rocket_launcher import rapidfire
-from flow_parser import FlowParser
+from checkpoint import Checkpoints, reusable_steps
+from flow_plan import parse_steps
+from resources import learn_from_status, record_resources
+from tracing import Tracer
+from workflow_status import WorkFlowStatus
 
 
-class WorkFlowStatus:
-    def __init__(self, path):
-        self.file_path = f'{path}/.workflow-status.json'
+# Seconds a rocket waits for Fireworks which depend on the ones of other rockets
+ROCKET_SLEEP_TIME = 0.5
+# Parameters of the queue adapter (e.g. the SLURM template) requesting the resources of a step
+QUEUE_RESOURCES = {'cpus_per_task': 'cores', 'mem': 'ram'}
 
-    def saveState(self, state):
-        with open(self.file_path, 'w') as out_file:
-            json.dump({'state': state}, out_file)
 
-        return True
+"""
+    Connects to the LaunchPad. With in_memory the database is replaced by
+    mongomock, which is only imported then, so workflows can be executed and
+    benchmarked without a MongoDb server. Such a LaunchPad only lives in this
+    process, rockets in other processes work on a copy of it (see workflow_completed).
+"""
+def connect_launchpad(db_connection, in_memory=False):
+    from fireworks import LaunchPad
+    if not in_memory:
+        return LaunchPad(**db_connection)
+    import mongomock
+    import mongomock.gridfs
+    from fireworks.core import launchpad as launchpad_module
+    # The LaunchPad keeps large actions in GridFS, which has to accept mongomock
+    mongomock.gridfs.enable_gridfs_integration()
+    mongo_client = launchpad_module.MongoClient
+    launchpad_module.MongoClient = mongomock.MongoClient
+    try:
+        lp = LaunchPad(**db_connection)
+    finally:
+        launchpad_module.MongoClient = mongo_client
+    lp.reset('', require_password=False)
+    return lp
 
-    def getState(self):
-        state = None
-        with open(self.file_path) as json_file:
-            state = json.load(json_file)
-        return state['state']
 
+"""
+    Inserts all workflows into the LaunchPad with a single call and launches
+    their Fireworks, and only theirs, as the LaunchPad is never reset. With more
+    than one rocket, every rocket is a process of its own with its own FWorker,
+    all of them share the connection of this process to the LaunchPad.
+    Returns the ids the LaunchPad has assigned to the Fireworks of every workflow.
+"""
+def launch_workflows(lp, workflows, rockets=1, tracer=None):
+    from fireworks import FWorker
+    from fireworks.core.rocket_launcher import rapidfire
+    from fireworks.features.multi_launcher import launch_multiprocess
+    tracer = tracer or Tracer(enabled=False)
 
+    # A LaunchPad which has never been used does not assign ids yet
+    if lp.fw_id_assigner.find_one() is None:
+        lp.reset('', require_password=False)
+    with tracer.phase('bulk_add_wfs', workflows=len(workflows)):
+        lp.bulk_add_wfs(workflows)
+    # The ids of the Fireworks have been reassigned by the LaunchPad
+    fw_ids = [list(wf.id_fw) for wf in workflows]
+    fworker = FWorker(query={'fw_id': {'$in': [fw_id for ids in fw_ids for fw_id in ids]}})
+    with tracer.phase('rapidfire', rockets=rockets):
+        if rockets > 1:
+            launch_multiprocess(lp, fworker, 'INFO', 0, rockets, ROCKET_SLEEP_TIME)
+        else:
+            rapidfire(lp, fworker, sleep_time=ROCKET_SLEEP_TIME)
+    return fw_ids
+
+
+"""
+    A workflow has completed once all of its steps have, as reported to its
+    status by the rockets. The LaunchPad of the engine cannot tell in every case:
+    the rockets of launch_multiprocess work on the copy of an in-memory LaunchPad
+    which lives in the process of their DataServer.
+"""
+def workflow_completed(status):
+    summary = status.getSummary()
+    return summary['failed'] == 0 and summary['completed'] == summary['total']
+
+
+"""
+    Spec of the Firework of a step, which carries the resources of the step:
+    as they are and as the request of a queue (_queueadapter) when the Firework
+    is launched through a queue with qlaunch
+"""
+def resource_spec(step, spec=None):
+    resources = step.get('resources')
+    if not resources:
+        return spec
+    queue = {key: resources[resource] for key, resource in QUEUE_RESOURCES.items() if resource in resources}
+    return {**(spec or {}), 'resources': resources, '_queueadapter': queue}
+
+
+"""
+    Process Engine executing the steps of a flow as Fireworks. FireWorks (and
+    with it pymongo) is only imported once a workflow is executed.
+    A connected launchpad can be shared by many runs (see engine_daemon), it is
+    never reset and every run only launches the Fireworks of its own workflow.
+    The same holds for a LaunchPad which is connected by the engine with reset
+    disabled. The Fireworks are launched by `rockets` processes in parallel.
+"""
 class FireworkEngine:
-    def __init__(self, output_path, input_file_path, db_connection):
+    def __init__(self, output_path, input_file_path, db_connection, incremental=False, content_hash=False,
+                 tracer=None, shards=None, launchpad=None, steps=None, reset=True, rockets=1, in_memory=False):
         self.state = WorkFlowStatus(output_path)
-        flow_parser = FlowParser(input_file_path)
-        self.commands = flow_parser.parse_command()
+        self.output_path = output_path
+        self.tracer = tracer or Tracer('fireworks', enabled=False)
+        # Steps which have been parsed before (e.g. by a Sweep) are used as they are
+        self.steps = steps if steps is not None else parse_steps(input_file_path, self.tracer)
+        # Line-parallel steps are split into shards by the rocket executing them
+        if shards:
+            for step in self.steps:
+                step['shards'] = shards
         self.db = db_connection
+        self.launchpad = launchpad
+        self.reset = reset
+        self.rockets = rockets
+        self.in_memory = in_memory
+        self.incremental = incremental
+        self.content_hash = content_hash
+        self.checkpoints = Checkpoints(output_path)
+        learn_from_status(self.steps, self.state, self.tracer)
+
+    """
+        The step is executed without a shell, a failing tool fizzles the Firework.
+        Every step writes its checkpoints, incremental steps are skipped if they
+        are up to date in the StepStore.
+    """
+    def step_task(self, idx, step, path=None, cwd=None):
+        from fireworks import PyTask
+        # Rockets run inside of their launcher directories, the status has to be found from there
+        args = [step, f'task_{idx}', os.path.abspath(path or self.output_path), self.incremental, self.content_hash]
+        if cwd is not None:
+            args.append(cwd)
+        return PyTask(func='checkpoint.execute_checkpointed', args=args)
 
-    def execute(self, name):
+    """
+        Workflow of Fireworks executing the steps, except for the reused ones.
+        Their checkpoints and status are written into path, with cwd the steps are
+        executed inside of it. spec is added to the spec of every Firework.
+    """
+    def workflow(self, name, steps, path=None, reused=(), cwd=None, spec=None):
+        from fireworks import Firework, Workflow
+        tasks = []
+        links = {}
+        for idx, step in enumerate(steps):
+            if idx in reused:
+                continue
+            tasks.append(Firework(self.step_task(idx, step, path, cwd), spec=resource_spec(step, spec),
+                                  name=f'task_{idx}', fw_id=idx))
+            # Only connect the steps which actually depend on each other,
+            # so independent branches of the flow can run in parallel
+            for dependency in step['depends_on']:
+                if dependency not in reused:
+                    links.setdefault(dependency, []).append(idx)
+        return Workflow(tasks, links_dict=links, name=name)
+
+    """
+        When resuming, the steps which have completed in the previous run are
+        left out of the workflow as long as their outputs are unchanged.
+        The steps are traced from the journal, as they are executed by the rockets.
+    """
+    def execute(self, name, resume=False):
+        start = time.time()
         try:
-            self.state.saveState('READY')
-            lp = LaunchPad(**self.db)
-            lp.reset('', require_password=False)
-            tasks = []
-            for idx, command in enumerate(self.commands):
-                if idx > 0:
-                    tasks.append(Firework(ScriptTask.from_str(
-                        command), name=f'task_{idx}', fw_id=idx, parents=[tasks[idx-1]]))
-                else:
-                    tasks.append(Firework(ScriptTask.from_str(
-                        command), name=f'task_{idx}', fw_id=idx))
-
-            self.state.saveState('RUNNING')
-            wf = Workflow(tasks, name=name)
-            lp.add_wf(wf)
-            rapidfire(lp)
-            self.state.saveState('FINISHED')
+            # Traced on its own, apart from connecting to the LaunchPad
+            with self.tracer.phase('import_fireworks'):
+                importlib.import_module('fireworks')
+            if resume:
+                reused = reusable_steps(self.steps, self.checkpoints)
+            else:
+                reused = set()
+                self.checkpoints.clear()
+
+            if self.launchpad is None:
+                with self.tracer.phase('launchpad_connect'):
+                    lp = connect_launchpad(self.db, self.in_memory)
+                if self.reset and not self.in_memory:
+                    with self.tracer.phase('launchpad_reset'):
+                        lp.reset('', require_password=False)
+            else:
+                lp = self.launchpad
+            if reused:
+                print(f'Resuming after {len(reused)} completed steps')
+            self.state.start(len(self.steps), len(reused))
+            if len(reused) == len(self.steps):
+                self.state.saveState('FINISHED')
+                return
+            with self.tracer.phase('build_workflow'):
+                # Rockets run inside of their launcher directories, the steps have to run in the
+                # working directory of the engine, as they do with the LocalEngine
+                wf = self.workflow(name, self.steps, reused=reused, cwd=os.getcwd())
+            launch_workflows(lp, [wf], self.rockets, self.tracer)
+            if workflow_completed(self.state):
+                self.state.saveState('FINISHED')
+            else:
+                self.state.saveState('ERROR')
         except Exception as e:
             print(e)
             self.state.saveState('ERROR')
+        finally:
+            record_resources(self.state)
+            if self.tracer.enabled:
+                self.tracer.steps_from_journal(self.state.runEvents(), start)
 
 
-parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('-p', metavar='Execution Path', required=True)
-parser.add_argument('-wf', metavar='Workflow Path',
-                    required=False, default=None)
-parser.add_argument('-s', metavar='Status', required=False, default=None)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute *.flow-Files with FireWorks.')
+    parser.add_argument('-p', metavar='Execution Path', required=True)
+    parser.add_argument('-wf', metavar='Workflow Path',
+                        required=False, default=None)
+    parser.add_argument('-s', metavar='Status', required=False, default=None,
+                        help='"summary" prints the progress of all steps, otherwise only the state')
 
-parser.add_argument('-dbhost', metavar='DB Host', required=False, default=None)
-parser.add_argument('-dbport', metavar='DB Port',
-                    type=int, required=False, default=None)
-parser.add_argument('-dbname', metavar='DB Name', required=False, default=None)
-parser.add_argument('-dbusername', metavar='DB Username',
-                    required=False, default=None)
-parser.add_argument('-dbpassword', metavar='DB Password',
-                    required=False, default=None)
-args = parser.parse_args()
+    parser.add_argument('-dbhost', metavar='DB Host', required=False, default=None)
+    parser.add_argument('-dbport', metavar='DB Port',
+                        type=int, required=False, default=None)
+    parser.add_argument('-dbname', metavar='DB Name', required=False, default=None)
+    parser.add_argument('-dbusername', metavar='DB Username',
+                        required=False, default=None)
+    parser.add_argument('-dbpassword', metavar='DB Password',
+                        required=False, default=None)
+    parser.add_argument('-i', '--incremental', action='store_true')
+    parser.add_argument('--hash', action='store_true')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--shards', metavar='Shards', type=int, required=False, default=None)
+    parser.add_argument('--no-reset', action='store_true')
+    parser.add_argument('-r', '--rockets', metavar='Rockets', type=int, required=False, default=1)
+    parser.add_argument('--mongomock', action='store_true')
+    parser.add_argument('--trace', metavar='Trace Path', required=False, default=None)
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], required=False, default='json')
+    args = parser.parse_args(argv)
 
-
-if __name__ == '__main__':
     db_connection = {
         "host": args.dbhost,
         "port": args.dbport,
@@ -82,9 +244,17 @@ if __name__ == '__main__':
 
     # Execute Workflow / startCommand
     if args.wf != None:
-        fp = FireworkEngine(args.p, args.wf, db_connection)
-        fp.execute(uuid.uuid4())
+        tracer = Tracer('fireworks', enabled=args.trace is not None)
+        fp = FireworkEngine(args.p, args.wf, db_connection, args.incremental, args.hash, tracer, args.shards,
+                            reset=not args.no_reset, rockets=args.rockets, in_memory=args.mongomock)
+        fp.execute(str(uuid.uuid4()), args.resume)
+        if args.trace != None:
+            tracer.write(args.trace, args.trace_format)
     # Execute statusCommand
     elif args.s != None:
         ws = WorkFlowStatus(args.p)
-        print(ws.getState())
+        print(ws.describe() if args.s == 'summary' else ws.getState())
+
+
+if __name__ == '__main__':
+    main()
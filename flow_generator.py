@@ -0,0 +1,136 @@
+import argparse
+import json
+import random
+
+
+SHAPES = ('chain', 'fan', 'deep')
+
+
+"""
+    Creates the ports of a ToolNode in the same layout as the ones
+    exported by the editor (see example_awk.flow)
+"""
+def tool_ports(value):
+    return [
+        {'name': 'Dependencies', 'port_direction': 'in', 'port_index': 0, 'position': 0,
+         'required': False, 'shortName': '', 'type': 'dependency', 'value': None},
+        {'name': 'arg0', 'port_direction': 'in', 'port_index': 1, 'position': 0,
+         'required': True, 'shortName': '', 'type': 'string', 'value': value},
+        {'name': 'stdin', 'port_direction': 'in', 'port_index': 2, 'position': 0,
+         'required': False, 'shortName': '', 'type': 'pipe', 'value': None},
+        {'name': 'Dependents', 'port_direction': 'out', 'port_index': 0, 'position': 0,
+         'required': False, 'shortName': '', 'type': 'dependency', 'value': None},
+        {'name': 'stdout', 'port_direction': 'out', 'port_index': 1, 'position': 0,
+         'required': False, 'shortName': '', 'type': 'pipe', 'value': None},
+    ]
+
+
+def tool_node(node_id, tool, value, position):
+    return {
+        'id': node_id,
+        'model': {'name': 'ToolNode', 'tool': {'name': tool, 'path': f'{tool} ', 'ports': tool_ports(value)}},
+        'position': position
+    }
+
+
+def connection(out_id, out_index, in_id, in_index):
+    return {'in_id': in_id, 'in_index': in_index, 'out_id': out_id, 'out_index': out_index}
+
+
+"""
+    Builds a flow out of the dependencies between its ToolNodes. The first tool
+    reads the FileInput through its stdin, the stdout of the last tool is written
+    to the FileOutput, the path of both is given by a String node like the
+    editor does. The nodes are written in random order to make sure the parser
+    does not rely on the order of the nodes inside of the file.
+"""
+def build_flow(dependencies, tool, input_path, output_path, rng):
+    nodes = []
+    connections = []
+    ids = [f'{{node-{idx}}}' for idx in range(len(dependencies))]
+    for idx, depends_on in enumerate(dependencies):
+        nodes.append(tool_node(ids[idx], tool, f'step{idx}', {'x': float(idx), 'y': 0.0}))
+        for dependency in depends_on:
+            connections.append(connection(ids[dependency], 0, ids[idx], 0))
+
+    nodes += [
+        {'id': '{input}', 'model': {'name': 'FileInput', 'path': input_path}, 'position': {'x': -1.0, 'y': 0.0}},
+        {'id': '{input-path}', 'model': {'name': 'String', 'value': input_path}, 'position': {'x': -2.0, 'y': 0.0}},
+        {'id': '{output}', 'model': {'createShortcut': True, 'name': 'FileOutput', 'outputFilePath': output_path},
+         'position': {'x': float(len(ids)), 'y': 0.0}},
+        {'id': '{output-path}', 'model': {'name': 'String', 'value': output_path},
+         'position': {'x': float(len(ids)), 'y': 1.0}},
+    ]
+    connections += [
+        connection('{input-path}', 0, '{input}', 1),
+        connection('{input}', 1, ids[0], 2),
+        connection(ids[-1], 1, '{output}', 3),
+        connection('{output-path}', 0, '{output}', 2),
+    ]
+    rng.shuffle(nodes)
+    rng.shuffle(connections)
+    return {'connections': connections, 'nodes': nodes}
+
+
+"""
+    Every tool depends on its predecessor
+"""
+def chain_dependencies(num_tools, width, rng):
+    return [[idx - 1] if idx > 0 else [] for idx in range(num_tools)]
+
+
+"""
+    A single tool fans out to all tools in between, which are joined by the last tool
+"""
+def fan_dependencies(num_tools, width, rng):
+    if num_tools < 3:
+        return chain_dependencies(num_tools, width, rng)
+    middle = list(range(1, num_tools - 1))
+    return [[]] + [[0] for _ in middle] + [middle]
+
+
+"""
+    Layers of `width` tools, every tool depends on one up to three random tools
+    of the previous layer, so the depth of the DAG grows with its size
+"""
+def deep_dependencies(num_tools, width, rng):
+    dependencies = []
+    for idx in range(num_tools):
+        layer_start = idx - idx % width
+        previous = range(max(layer_start - width, 0), layer_start)
+        dependencies.append(sorted(rng.sample(previous, min(len(previous), rng.randint(1, 3)))))
+    return dependencies
+
+
+"""
+    Generates a flow of the given shape with num_nodes nodes in total,
+    including the FileInput, the FileOutput and the String nodes of their paths
+"""
+def generate_flow(shape, num_nodes, tool='true', width=4, seed=0,
+                  input_path='input.txt', output_path='output.txt'):
+    rng = random.Random(seed)
+    num_tools = max(num_nodes - 4, 1)
+    shapes = {'chain': chain_dependencies, 'fan': fan_dependencies, 'deep': deep_dependencies}
+    dependencies = shapes[shape](num_tools, width, rng)
+    return build_flow(dependencies, tool, input_path, output_path, rng)
+
+
+def write_flow(flow_file_path, flow):
+    with open(flow_file_path, 'w') as output:
+        json.dump(flow, output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic *.flow-Files.')
+    parser.add_argument('-shape', choices=SHAPES, required=False, default='chain')
+    parser.add_argument('-nodes', metavar='Nodes', type=int, required=True)
+    parser.add_argument('-o', metavar='Output Path', required=True)
+    parser.add_argument('-tool', metavar='Tool', required=False, default='true')
+    parser.add_argument('-width', metavar='Width', type=int, required=False, default=4)
+    parser.add_argument('-seed', metavar='Seed', type=int, required=False, default=0)
+    parser.add_argument('-input', metavar='Input File', required=False, default='input.txt')
+    parser.add_argument('-output', metavar='Output File', required=False, default='output.txt')
+    args = parser.parse_args()
+
+    write_flow(args.o, generate_flow(args.shape, args.nodes, args.tool, args.width, args.seed,
+                                     args.input, args.output))
@@ -0,0 +1,209 @@
+import sys
+from collections import deque
+
+
+# Nodes which only carry a literal value for the ports of other nodes
+LITERAL_NODES = ('String', 'Boolean')
+# FileInput nodes do not define ports, their content is streamed through this output
+FILE_INPUT_STREAM_INDEX = 1
+# Values of the parallel attribute of a ToolNode which processes its stdin line by
+# line: the outputs of its shards are either concatenated or merged like sort -m
+LINE_PARALLEL_MODES = ('lines', 'sort')
+# Resources a ToolNode can request: cores, RAM and space of its tmpdir in MiB
+RESOURCE_KEYS = ('cores', 'ram', 'tmpdir')
+
+
+class Port:
+    __slots__ = ('name', 'index', 'direction', 'type', 'position', 'short_name', 'value')
+
+    def __init__(self, name, index, direction, type, position, short_name, value):
+        self.name = sys.intern(name)
+        self.index = index
+        self.direction = sys.intern(direction)
+        self.type = sys.intern(type)
+        self.position = position
+        self.short_name = short_name
+        self.value = value
+
+    @classmethod
+    def from_json(cls, port):
+        return cls(port['name'], port['port_index'], port['port_direction'], port['type'],
+                   port['position'], port['shortName'], port['value'])
+
+
+class Edge:
+    __slots__ = ('out_id', 'out_index', 'in_id', 'in_index')
+
+    def __init__(self, out_id, out_index, in_id, in_index):
+        self.out_id = out_id
+        self.out_index = out_index
+        self.in_id = in_id
+        self.in_index = in_index
+
+
+"""
+    A single executable node of a flow. Depending on the kind of the node
+    the path is either the path of the FileInput, the outputFilePath of the
+    FileOutput or the path of the tool of a ToolNode. parallel marks a tool
+    whose stdin can be split into chunks of lines (see LINE_PARALLEL_MODES),
+    resources holds the hints of a tool for its scheduling (see RESOURCE_KEYS).
+"""
+class Node:
+    __slots__ = ('id', 'kind', 'path', 'ports', 'parallel', 'resources', 'inputs', 'outputs',
+                 'stdin_index', 'stdout_index')
+
+    def __init__(self, node_id, kind, path, ports=(), parallel=None, resources=None):
+        if parallel is not None and parallel not in LINE_PARALLEL_MODES:
+            raise ValueError(f'Unknown parallel mode {parallel!r} of node {node_id}')
+        for key, value in (resources or {}).items():
+            if key not in RESOURCE_KEYS or type(value) not in (int, float) or value <= 0:
+                raise ValueError(f'Invalid resource {key!r}: {value!r} of node {node_id}')
+        self.id = sys.intern(node_id)
+        self.kind = sys.intern(kind)
+        self.path = path
+        self.ports = tuple(ports)
+        self.parallel = parallel
+        self.resources = resources or None
+        self.inputs = []
+        self.outputs = []
+        self.stdin_index = None
+        self.stdout_index = FILE_INPUT_STREAM_INDEX if kind == 'FileInput' else None
+        for port in self.ports:
+            if port.name == 'stdin' and port.direction == 'in':
+                self.stdin_index = port.index
+            elif port.name == 'stdout' and port.direction == 'out':
+                self.stdout_index = port.index
+
+    @classmethod
+    def from_json(cls, node):
+        model = node['model']
+        if model['name'] == 'FileInput':
+            return cls(node['id'], 'FileInput', model['path'])
+        if model['name'] == 'FileOutput':
+            return cls(node['id'], 'FileOutput', model['outputFilePath'])
+        tool = model.get('tool', {})
+        ports = [Port.from_json(port) for port in tool.get('ports', [])]
+        return cls(node['id'], model['name'], tool.get('path', ''), ports, tool.get('parallel'), tool.get('resources'))
+
+    def port(self, direction, index):
+        for port in self.ports:
+            if port.index == index and port.direction == direction:
+                return port
+        return None
+
+    """
+        Ports of a ToolNode which carry a value and therefore end up as an
+        argument of the command
+    """
+    def arguments(self):
+        return [port for port in self.ports if port.value != None and port.value]
+
+
+"""
+    Compact in-memory representation of a *.flow-File. Only executable nodes
+    are kept, connections are stored once and indexed by the (node_id, port_index)
+    of both of their ends.
+"""
+class FlowGraph:
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+        self.in_edges = {}
+        self.out_edges = {}
+
+    @classmethod
+    def from_json(cls, json_data):
+        graph = cls()
+        literals = {}
+        for node in json_data['nodes']:
+            if node['model']['name'] in LITERAL_NODES:
+                literals[node['id']] = node['model'].get('value')
+            else:
+                graph.add_node(Node.from_json(node))
+        for connection in json_data['connections']:
+            if connection['out_id'] in literals:
+                graph.set_literal(connection['in_id'], connection['in_index'], literals[connection['out_id']])
+            else:
+                graph.add_edge(connection['out_id'], connection['out_index'],
+                               connection['in_id'], connection['in_index'])
+        return graph
+
+    def add_node(self, node):
+        self.nodes[node.id] = node
+
+    """
+        Resolves the value of a String or Boolean node into the port it is
+        connected to, values which have been set on the port itself take precedence
+    """
+    def set_literal(self, in_id, in_index, value):
+        node = self.nodes.get(in_id)
+        if node is None:
+            return
+        port = node.port('in', in_index)
+        if port is not None and port.value is None:
+            port.value = value
+
+    """
+        Adds a connection between two nodes of the graph, connections to nodes
+        which are not part of the graph (e.g. String nodes) are dropped
+    """
+    def add_edge(self, out_id, out_index, in_id, in_index):
+        source = self.nodes.get(out_id)
+        target = self.nodes.get(in_id)
+        if source is None or target is None:
+            return None
+
+        edge = Edge(source.id, out_index, target.id, in_index)
+        self.edges.append(edge)
+        source.outputs.append(edge)
+        target.inputs.append(edge)
+        self.out_edges.setdefault((source.id, out_index), []).append(edge)
+        self.in_edges.setdefault((target.id, in_index), []).append(edge)
+        return edge
+
+    def edges_from(self, node_id, port_index):
+        return self.out_edges.get((node_id, port_index), [])
+
+    def edges_to(self, node_id, port_index):
+        return self.in_edges.get((node_id, port_index), [])
+
+    """
+        Returns the node whose stdout (or file content) is streamed into the given node
+    """
+    def stream_source(self, node):
+        if node.kind == 'FileOutput':
+            for edge in node.inputs:
+                source = self.nodes[edge.out_id]
+                if edge.out_index == source.stdout_index:
+                    return source
+            return None
+
+        if node.stdin_index is None:
+            return None
+        for edge in self.edges_to(node.id, node.stdin_index):
+            source = self.nodes[edge.out_id]
+            if edge.out_index == source.stdout_index:
+                return source
+        return None
+
+    """
+        Kahn's algorithm over the adjacency lists of the nodes. Nodes without
+        inputs are started in the order in which they appear in the flow file,
+        so single-chain flows keep the order of their chain.
+    """
+    def topological_order(self):
+        remaining = {node_id: len(node.inputs) for node_id, node in self.nodes.items()}
+        ready = deque(node_id for node_id, count in remaining.items() if count == 0)
+
+        ordered_nodes = []
+        while ready:
+            node = self.nodes[ready.popleft()]
+            ordered_nodes.append(node)
+            for edge in node.outputs:
+                remaining[edge.in_id] -= 1
+                if remaining[edge.in_id] == 0:
+                    ready.append(edge.in_id)
+
+        if len(ordered_nodes) < len(self.nodes):
+            raise ValueError('The flow contains a cycle and cannot be executed')
+        return ordered_nodes
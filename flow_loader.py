@@ -0,0 +1,306 @@
+import re
+import sys
+from json import JSONDecodeError, JSONDecoder
+from json.decoder import scanstring
+
+from flow_graph import LITERAL_NODES, FlowGraph, Node
+
+
+DECODER = JSONDecoder()
+SEPARATOR_RE = re.compile(r'[ \t\n\r,:]*')
+NUMBER_RE = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+VALUE_END_RE = re.compile(r'[\s,\]}]')
+SKIP_RE = re.compile(r'[^"{}\[\]]*')
+STRING_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+# Keys of the *.flow-File which are relevant for the execution, everything else
+# (position, createShortcut, version, ...) is skipped while reading
+MODEL_KEYS = ('name', 'path', 'outputFilePath', 'value')
+TOOL_KEYS = ('path', 'parallel', 'resources')
+PORT_KEYS = ('name', 'port_index', 'port_direction', 'type', 'position', 'shortName', 'value')
+
+
+"""
+    Incremental JSON tokenizer, reading the file in chunks and emitting
+    one event per token: start_map, map_key, end_map, start_array,
+    end_array and value. Values of unused keys can be skipped without
+    ever building the corresponding python objects.
+"""
+class JSONEventReader:
+    def __init__(self, stream, chunk_size=64 * 1024):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        # Each entry is [container, expect_key] of the currently open containers
+        self.stack = []
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.pos = SEPARATOR_RE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return None
+
+    def _ensure(self, length):
+        while len(self.buffer) - self.pos < length and self._fill():
+            pass
+
+    def _read_string(self):
+        while True:
+            try:
+                value, self.pos = scanstring(self.buffer, self.pos + 1)
+                return value
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def _read_number(self):
+        # Make sure the number is not cut off at the end of the current chunk
+        while VALUE_END_RE.search(self.buffer, self.pos) is None and self._fill():
+            pass
+        match = NUMBER_RE.match(self.buffer, self.pos)
+        if match is None:
+            raise JSONDecodeError('Expecting value', self.buffer, self.pos)
+        self.pos = match.end()
+        integer, fraction, exponent = match.groups()
+        if fraction or exponent:
+            return float(match.group(0))
+        return int(integer)
+
+    def _value_done(self):
+        if self.stack and self.stack[-1][0] == 'map':
+            self.stack[-1][1] = True
+
+    def next_event(self):
+        char = self._peek()
+        if char is None:
+            return None
+
+        if char == '{' or char == '[':
+            self.pos += 1
+            self.stack.append(['map', True] if char == '{' else ['array', False])
+            return ('start_map' if char == '{' else 'start_array', None)
+
+        if char == '}' or char == ']':
+            self.pos += 1
+            self.stack.pop()
+            self._value_done()
+            return ('end_map' if char == '}' else 'end_array', None)
+
+        if char == '"':
+            value = self._read_string()
+            if self.stack and self.stack[-1][0] == 'map' and self.stack[-1][1]:
+                self.stack[-1][1] = False
+                return ('map_key', value)
+            self._value_done()
+            return ('value', value)
+
+        self._ensure(5)
+        for literal, value in LITERALS.items():
+            if self.buffer.startswith(literal, self.pos):
+                self.pos += len(literal)
+                self._value_done()
+                return ('value', value)
+
+        value = self._read_number()
+        self._value_done()
+        return ('value', value)
+
+    def expect(self, expected_event):
+        event = self.next_event()
+        if event is None or event[0] != expected_event:
+            raise JSONDecodeError(f'Expecting {expected_event}', self.buffer, self.pos)
+        return event[1]
+
+    """
+        Yields the keys of the map which has just been opened, the caller has
+        to consume (read or skip) the value of each key before requesting the next one
+    """
+    def keys(self):
+        while True:
+            event = self.next_event()
+            if event is None:
+                raise JSONDecodeError('Unterminated object', self.buffer, self.pos)
+            if event[0] == 'end_map':
+                return
+            yield event[1]
+
+    """
+        Yields once for every element of the array which has just been opened,
+        the caller has to consume the element itself
+    """
+    def items(self):
+        while True:
+            if self._peek() == ']':
+                self.next_event()
+                return
+            yield
+
+    def read_value(self):
+        event, value = self.next_event()
+        if event == 'start_map':
+            return {key: self.read_value() for key in self.keys()}
+        if event == 'start_array':
+            return [self.read_value() for _ in self.items()]
+        return value
+
+    """
+        Reads a small value (e.g. a port or a connection) at once with the
+        decoder of the json module, large values should be read with read_value
+    """
+    def read_small_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+                break
+            except JSONDecodeError:
+                if not self._fill():
+                    raise
+        self.pos = end
+        self._value_done()
+        return value
+
+    """
+        Skips the next value without tokenizing it, nested containers are
+        only scanned for their brackets and strings
+    """
+    def skip_value(self):
+        if self._peek() not in '{[':
+            self.next_event()
+            return
+
+        depth = 0
+        while True:
+            self.pos = SKIP_RE.match(self.buffer, self.pos).end()
+            if self.pos == len(self.buffer):
+                if not self._fill():
+                    raise JSONDecodeError('Unterminated value', self.buffer, self.pos)
+                continue
+
+            char = self.buffer[self.pos]
+            if char == '"':
+                match = STRING_RE.match(self.buffer, self.pos)
+                if match is None:
+                    # The string is cut off at the end of the current chunk
+                    if not self._fill():
+                        raise JSONDecodeError('Unterminated string', self.buffer, self.pos)
+                    continue
+                self.pos = match.end()
+            elif char == '{' or char == '[':
+                depth += 1
+                self.pos += 1
+            else:
+                depth -= 1
+                self.pos += 1
+                if depth == 0:
+                    self._value_done()
+                    return
+
+
+"""
+    Builds the FlowGraph of a *.flow-File while it is read. Layout information
+    and other unused keys are skipped, String and Boolean nodes are only kept
+    as values until they have been resolved into the ports they are connected to.
+"""
+class FlowLoader:
+    def __init__(self, reader):
+        self.reader = reader
+        self.graph = FlowGraph()
+        self.literals = {}
+        self.connections = []
+
+    def _read_fields(self, allowed_keys):
+        fields = self.reader.read_small_value()
+        return {key: fields[key] for key in allowed_keys if key in fields}
+
+    def _read_tool(self):
+        tool = {}
+        self.reader.expect('start_map')
+        for key in self.reader.keys():
+            if key == 'ports':
+                self.reader.expect('start_array')
+                tool['ports'] = [self._read_fields(PORT_KEYS) for _ in self.reader.items()]
+            elif key in TOOL_KEYS:
+                tool[key] = self.reader.read_value()
+            else:
+                self.reader.skip_value()
+        return tool
+
+    def _read_model(self):
+        model = {}
+        self.reader.expect('start_map')
+        for key in self.reader.keys():
+            if key == 'tool':
+                model['tool'] = self._read_tool()
+            elif key in MODEL_KEYS:
+                model[key] = self.reader.read_value()
+            else:
+                self.reader.skip_value()
+        return model
+
+    def _read_node(self):
+        node = {}
+        self.reader.expect('start_map')
+        for key in self.reader.keys():
+            if key == 'id':
+                node['id'] = self.reader.read_value()
+            elif key == 'model':
+                node['model'] = self._read_model()
+            else:
+                self.reader.skip_value()
+
+        if node['model']['name'] in LITERAL_NODES:
+            self.literals[sys.intern(node['id'])] = node['model'].get('value')
+        else:
+            self.graph.add_node(Node.from_json(node))
+
+    def _read_connection(self):
+        connection = self._read_fields(('in_id', 'in_index', 'out_id', 'out_index'))
+        # Connections can appear before the nodes in the file, keep them until all nodes are known
+        self.connections.append((
+            sys.intern(connection['out_id']), connection['out_index'],
+            sys.intern(connection['in_id']), connection['in_index']))
+
+    def load(self):
+        self.reader.expect('start_map')
+        for key in self.reader.keys():
+            if key == 'nodes':
+                self.reader.expect('start_array')
+                for _ in self.reader.items():
+                    self._read_node()
+            elif key == 'connections':
+                self.reader.expect('start_array')
+                for _ in self.reader.items():
+                    self._read_connection()
+            else:
+                self.reader.skip_value()
+
+        for out_id, out_index, in_id, in_index in self.connections:
+            if out_id in self.literals:
+                self.graph.set_literal(in_id, in_index, self.literals[out_id])
+            else:
+                self.graph.add_edge(out_id, out_index, in_id, in_index)
+        self.literals = {}
+        self.connections = []
+        return self.graph
+
+
+def load_flow(input_file_path, chunk_size=64 * 1024):
+    with open(input_file_path) as flow_file:
+        return FlowLoader(JSONEventReader(flow_file, chunk_size)).load()
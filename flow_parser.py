@@ -1,86 +1,170 @@
 import argparse
-import json
+import shlex
+
+from flow_loader import load_flow
+from resources import add_resources
+from tracing import Tracer
 
 
 class FlowParser:
-    def __init__(self, input_file_path):
-        with open(input_file_path) as json_file:
-            self.json_data = json.load(json_file)
+    def __init__(self, input_file_path, tracer=None):
+        self.tracer = tracer or Tracer(enabled=False)
+        with self.tracer.phase('load_flow', path=input_file_path) as args:
+            self.graph = load_flow(input_file_path)
+            args['nodes'] = len(self.graph.nodes)
 
-        self.connections = self.json_data['connections']
-        self.nodes = self.json_data['nodes']
+        self.connections = self.graph.edges
+        self.nodes = list(self.graph.nodes.values())
 
     def transform_nodes(self):
-        # Remove position key from nodes, as it is not relevant for the workflow
-        result_nodes = []
-        for node in self.nodes:
-            node.pop('position', None)
-            if node['model']['name'] != 'String' and node['model']['name'] != 'Boolean':
-                result_nodes.append(node)
-                
-        self.nodes = result_nodes
-    
-        result_connections = []
-        for connection in self.connections:
-            in_id = list(filter(lambda node : node['id'] == connection['in_id'], self.nodes))
-            out_id = list(filter(lambda node : node['id'] == connection['out_id'], self.nodes))
-
-            if len(in_id) > 0 and len(out_id) > 0:
-                result_connections.append(connection)
-        self.connections = result_connections
+        # String and Boolean nodes as well as the layout information have already
+        # been dropped by the graph, only the execution order is left to resolve
+        with self.tracer.phase('transform_nodes'):
+            self.nodes = self.graph.topological_order()
+
+    @staticmethod
+    def tool_command(node):
+        command = f'{node.path}'
+        for port in node.arguments():
+            value = '' if type(port.value) is bool else port.value
+            if 'arg' in port.name:
+                command += f'{value} '
+            else:
+                command += f'--{port.name} {value} '
+        return command
 
+    """
+        Same arguments as tool_command, but as an argument list which can be
+        executed without a shell. Quotes are resolved the way the shell would.
+    """
+    @staticmethod
+    def tool_argv(node):
+        argv = shlex.split(node.path)
+        for port in node.arguments():
+            if 'arg' not in port.name:
+                argv.append(f'--{port.name}')
+            if type(port.value) is not bool:
+                argv += shlex.split(str(port.value))
+        return argv
 
+    """
+        File the stdout of a tool is written into when it is read by more than
+        one node and none of them is a FileOutput
+    """
+    @staticmethod
+    def stream_path(node):
+        return f'.stream-{node.id.strip("{}")}'
+
+    """
+        Groups the nodes, in the order of transform_nodes, into the steps which
+        have to be executed. Nodes which are connected through stdout/stdin are
+        piped into a single step. Every step depends on the steps of all tools
+        it has a connection from.
+        A stream with more than one reader is not piped: the step of a tool ends
+        with it and writes it into its FileOutputs (or stream_path), every further
+        reader of a tool or of a FileInput gets a step of its own reading the file.
+        Besides the shell command, each step describes its pipeline as argument
+        lists together with the file its stdin is read from and the files its stdout
+        is written to. parallel holds the parallel mode of every tool of the pipeline,
+        resources the sum of the resource hints of its tools.
+    """
+    def group_steps(self):
+        steps = []
+        # Index of the step each node is executed in
+        step_index = {}
+        # Nodes reading the stdout (or file content) of every node, in execution order
+        readers = {}
+        for node in self.nodes:
+            source = self.graph.stream_source(node)
+            if source is not None:
+                readers.setdefault(source.id, []).append(node)
+        # Files the streams of the nodes with more than one reader are read from
+        stream_files = {}
         for node in self.nodes:
-            node['num_inputs'] = len(list(filter(lambda connection : node['id'] == connection['in_id'], self.connections)))
-        
-        self.nodes = sorted(self.nodes, key=lambda node : node['num_inputs'])
+            source = self.graph.stream_source(node)
+            piped = source is not None and source.id in step_index
+            if piped and source.kind == 'FileInput':
+                stream_files[source.id] = source.path
 
-        sorted_nodes = [self.nodes[0]]
+            if node.kind == 'FileInput':
+                step_index[node.id] = len(steps)
+                steps.append({'command': f'cat {node.path} | ', 'depends_on': [],
+                              'stdin': node.path, 'pipeline': [], 'parallel': [], 'outputs': [], 'resources': {}})
 
-        while len(sorted_nodes) < len(self.nodes):
-            node = sorted_nodes[-1]
-            out_connections = list(filter(lambda connection : node['id'] == connection['out_id'], self.connections))
-            sorted_nodes.append(next(node for node in self.nodes if node['id'] == out_connections[0]['in_id']))
+            elif node.kind == 'FileOutput':
+                if not piped:
+                    continue
+                step = steps[step_index[source.id]]
+                if source.kind == 'ToolNode' and source.id in stream_files:
+                    # Has been added to the outputs of the step of its tool already
+                    step_index[node.id] = step_index[source.id]
+                elif source.kind == 'ToolNode' or not step['pipeline']:
+                    step_index[node.id] = step_index[source.id]
+                    step['command'] += f' > {node.path}'
+                    step['outputs'].append(node.path)
+                else:
+                    # The step of the FileInput pipes it into a tool already
+                    step_index[node.id] = len(steps)
+                    steps.append({'command': f'cat {source.path} |  > {node.path}', 'depends_on': [],
+                                  'stdin': source.path, 'pipeline': [], 'parallel': [], 'outputs': [node.path],
+                                  'resources': {}})
 
-        self.nodes = sorted_nodes
-        
+            elif node.kind == 'ToolNode':
+                command = self.tool_command(node)
+                argv = self.tool_argv(node)
+                joined = piped and (source.kind == 'ToolNode' and source.id not in stream_files or
+                                    not steps[step_index[source.id]]['pipeline'] and
+                                    not steps[step_index[source.id]]['outputs'])
+                if joined:
+                    step_index[node.id] = step_index[source.id]
+                    step = steps[step_index[node.id]]
+                    step['command'] += command if source.kind == 'FileInput' else f'| {command}'
+                    step['pipeline'].append(argv)
+                    step['parallel'].append(node.parallel)
+                    add_resources(step['resources'], node.resources)
+                elif piped:
+                    # Every further reader of a stream gets a step of its own
+                    stream_file = stream_files[source.id]
+                    step_index[node.id] = len(steps)
+                    steps.append({'command': f'cat {stream_file} | {command}', 'depends_on': [],
+                                  'stdin': stream_file, 'pipeline': [argv], 'parallel': [node.parallel],
+                                  'outputs': [], 'resources': add_resources({}, node.resources)})
+                else:
+                    step_index[node.id] = len(steps)
+                    steps.append({'command': command, 'depends_on': [], 'stdin': None, 'pipeline': [argv],
+                                  'parallel': [node.parallel], 'outputs': [],
+                                  'resources': add_resources({}, node.resources)})
 
-    def parse_command(self):
-        self.transform_nodes()
-        for node in self.nodes:
-            if node['model']['name'] == 'FileInput':
-                node['command'] = f'cat {node["model"]["path"]} | '
-                node['connect_next'] = True
-            
-            elif node['model']['name'] == 'FileOutput':
-                node['command'] = f' > {node["model"]["outputFilePath"]}'
-                node['connect_prev'] = True
-            
-            elif node['model']['name']  == 'ToolNode':
-                first_command = node['model']['tool']['path']
-                ports = node['model']['tool']['ports']
-                arguments = [{'key': port['name'], 'value': port['value']} for port in ports if port['value'] != None and port['value']]
-            
-                node['command'] = f'{first_command}'
-                for arg in arguments: 
-                    if type(arg['value']) is bool:
-                        arg['value'] = ''
-                    if 'arg' in arg['key']:
-                        node['command'] += f'{arg["value"]} '
-                    else:
-                        node['command'] += f'--{arg["key"]} {arg["value"]} '
-
-        commands = []
-        skip = False
-        for idx, node in enumerate(self.nodes):
-            if skip == True:
-                skip = False
+                if len(readers.get(node.id, ())) > 1:
+                    step = steps[step_index[node.id]]
+                    outputs = [reader.path for reader in readers[node.id] if reader.kind == 'FileOutput']
+                    outputs = outputs or [self.stream_path(node)]
+                    step['command'] += ''.join(f' > {path}' for path in outputs)
+                    step['outputs'] += outputs
+                    stream_files[node.id] = outputs[0]
+
+        # Sets, so a step with many dependencies is not scanned for every edge
+        depends_on = [set() for _ in steps]
+        for edge in self.connections:
+            # A FileInput exists before the flow runs, its readers only share the
+            # step of the first of them and do not depend on each other
+            if self.graph.nodes[edge.out_id].kind == 'FileInput':
                 continue
-            if node.get('connect_next'):
-                commands.append(node['command'] + self.nodes[idx + 1]['command'])
-                skip = True
-            elif node.get('connect_prev'):
-                commands[-1] = commands[-1] + node['command']
-            else:
-                commands.append(node['command'])
-        return commands
\ No newline at end of file
+            out_step = step_index.get(edge.out_id)
+            in_step = step_index.get(edge.in_id)
+            if out_step is None or in_step is None or out_step == in_step:
+                continue
+            depends_on[in_step].add(out_step)
+        for step, dependencies in zip(steps, depends_on):
+            step['depends_on'] = sorted(dependencies)
+        return steps
+
+    def parse_steps(self):
+        self.transform_nodes()
+        with self.tracer.phase('parse_steps') as args:
+            steps = self.group_steps()
+            args['steps'] = len(steps)
+        return steps
+
+    def parse_command(self):
+        return [step['command'] for step in self.parse_steps()]
@@ -0,0 +1,118 @@
+import hashlib
+import marshal
+import os
+import struct
+import tempfile
+
+from tracing import Tracer
+
+
+PLAN_SUFFIX = '.plan'
+PLAN_MAGIC = b'PEPLAN'
+# Has to be increased whenever the content of the payload changes
+PLAN_VERSION = 4
+# Magic, version of the plan, version of marshal and the sha256 of the *.flow-File
+PLAN_HEADER = struct.Struct('>6sHH32s')
+
+
+def is_plan(path):
+    return path.endswith(PLAN_SUFFIX)
+
+
+def plan_path(flow_file_path):
+    return os.path.splitext(flow_file_path)[0] + PLAN_SUFFIX
+
+
+def source_hash(flow_file_path):
+    with open(flow_file_path, 'rb') as flow_file:
+        return hashlib.sha256(flow_file.read()).digest()
+
+
+"""
+    Compiles a *.flow-File into a plan: the steps executed by the Local Process
+    Engine and the FireWorks Process Engine together with the parsed steps of
+    the CWL workflow. The plan is written into a temporary file first and then
+    renamed, so a process never reads an incomplete plan.
+"""
+def compile_plan(flow_file_path, output_path=None, tracer=None):
+    # Only imported when a flow has to be parsed
+    from flow_to_cwl_parser import FlowToCWLParser
+    tracer = tracer or Tracer(enabled=False)
+    output_path = output_path or plan_path(flow_file_path)
+    digest = source_hash(flow_file_path)
+    cwl_parser = FlowToCWLParser(flow_file_path, tracer)
+    cwl_parser.compile()
+    plan = {
+        'source': os.path.abspath(flow_file_path),
+        'name': cwl_parser.name,
+        'steps': cwl_parser.flow_parser.parse_steps(),
+        # Kept as marshal data of its own, every compile of a FlowToCWLParser
+        # restores a fresh copy of it, see FlowToCWLParser.restore
+        'cwl': marshal.dumps(cwl_parser.compiled_state())
+    }
+    with tracer.phase('write_plan', path=output_path):
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'wb') as plan_file:
+                plan_file.write(PLAN_HEADER.pack(PLAN_MAGIC, PLAN_VERSION, marshal.version, digest))
+                marshal.dump(plan, plan_file)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return plan
+
+
+"""
+    Reads a plan, returns None if it has been written by another version
+    (or is not a plan at all) together with the hash of its source
+"""
+def read_plan(path):
+    with open(path, 'rb') as plan_file:
+        data = plan_file.read()
+    if len(data) < PLAN_HEADER.size:
+        return None, None
+    magic, version, marshal_version, digest = PLAN_HEADER.unpack_from(data)
+    if magic != PLAN_MAGIC or version != PLAN_VERSION or marshal_version != marshal.version:
+        return None, None
+    try:
+        return marshal.loads(memoryview(data)[PLAN_HEADER.size:]), digest
+    except (EOFError, ValueError, TypeError):
+        return None, None
+
+
+"""
+    Loads the plan of a flow. path is either the plan or the *.flow-File, whose
+    plan is kept next to it. The plan is compiled again whenever it is missing,
+    has been written by another version or the *.flow-File it has been compiled
+    from has changed. A plan whose source no longer exists is used as it is.
+"""
+def load_plan(path, tracer=None):
+    tracer = tracer or Tracer(enabled=False)
+    flow_file_path = None if is_plan(path) else path
+    path = path if is_plan(path) else plan_path(path)
+    with tracer.phase('load_plan', path=path) as args:
+        try:
+            plan, digest = read_plan(path)
+        except FileNotFoundError:
+            if flow_file_path is None:
+                raise
+            plan, digest = None, None
+        source = flow_file_path or (plan['source'] if plan is not None else None)
+        args['compiled'] = plan is None or (os.path.exists(source) and source_hash(source) != digest)
+    if not args['compiled']:
+        return plan
+    if source is None:
+        raise ValueError(f'{path} is not a plan of this version and its source is unknown')
+    return compile_plan(source, path, tracer)
+
+
+"""
+    Steps of a flow, loaded from its plan for a plan and parsed for a *.flow-File
+"""
+def parse_steps(path, tracer=None):
+    if is_plan(path):
+        return load_plan(path, tracer)['steps']
+    from flow_parser import FlowParser
+    return FlowParser(path, tracer).parse_steps()
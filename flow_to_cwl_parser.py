@@ -1,35 +1,150 @@
-import argparse
+import copy
+import hashlib
 import json
-import yaml
+import marshal
 import os
+import re
+import shlex
+import shutil
 
 from flow_parser import FlowParser
-        
+from flow_plan import is_plan, load_plan, source_hash
+from resources import add_resources
+from tracing import Tracer
+
+
+CWL_VERSION = 'v1.1'
+# Has to be increased whenever the CWL files generated for the same flow change
+GENERATOR_VERSION = 2
+# Files of an entry of the CWL cache besides the definitions, see write_cache_entry
+CACHED_PARAMS = 'flow-params.yml'
+CACHE_MANIFEST = 'manifest.json'
+CWL_OPENER = '#!/usr/bin/env cwl-runner\n\n'
+# Range of argument positions of every tool of a fused pipeline, the command of
+# the tool comes first, followed by the inputs of its ports
+STAGE_POSITIONS = 1000
+STAGE_INPUT_OFFSET = 100
+# /bin/sh has no pipefail, so the tools of a fused pipeline are wrapped: every tool
+# but the last writes its failing exit status to fd 3, which is collected by $(...),
+# while the last one writes to stdout through fd 4. The pipeline fails if any tool does.
+# $( is escaped, as it would be evaluated as a parameter reference otherwise.
+PIPEFAIL_OPEN = 'exec 4>&1; failed=\\$({ {'
+PIPEFAIL_NEXT = '|| echo $? >&3; } | {'
+PIPEFAIL_LAST = '|| echo $? >&3; } |'
+PIPEFAIL_CLOSE = '>&4; } 3>&1) && [ -z "$failed" ]'
+# Field of the ResourceRequirement every resource hint of a tool is passed as
+CWL_RESOURCES = {'cores': 'coresMin', 'ram': 'ramMin', 'tmpdir': 'tmpdirMin'}
+# Attributes set by parse_commands, which are stored in a plan
+COMPILED_ATTRIBUTES = ('steps', 'step_kinds', 'base_commands', 'step_arguments', 'step_resources',
+                       'workflow_input_list', 'workflow_job_values', 'workflow_output_list', 'workflow_sources',
+                       'input_targets')
+
+
+"""
+    Key of the CWL files generated for a flow in the CWL cache. It only depends on
+    the *.flow-File (or plan) itself and on how the files are generated, so it is
+    known without parsing the flow. The home directory is part of it, as ~ is
+    expanded in the parameter file.
+"""
+def definitions_cache_key(flow_file_path, fuse=False, packed=False):
+    digest = hashlib.sha256(source_hash(flow_file_path))
+    digest.update(json.dumps([GENERATOR_VERSION, fuse, packed, os.path.expanduser('~')]).encode())
+    return digest.hexdigest()
+
+
+"""
+    Paths of the workflow and of the parameter file of a cached flow, together
+    with its steps. The parameter file is copied into output_dir, as relative
+    paths inside of it are resolved relative to its own directory.
+"""
+def read_cache_entry(entry_dir, packed=False, output_dir=''):
+    with open(os.path.join(entry_dir, CACHE_MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    workflow_param_name = os.path.join(output_dir, f'{manifest["name"]}-params.yml')
+    shutil.copyfile(os.path.join(entry_dir, CACHED_PARAMS), workflow_param_name)
+    return FlowToCWLParser.definitions_path(entry_dir, 'flow', packed), workflow_param_name, manifest['steps']
+
+
+"""
+    Documents are written as JSON, which every YAML parser (and so every CWL
+    runner) reads as well, but which is written many times faster than YAML
+"""
+def dump_document(data, output):
+    output.write(json.dumps(data))
+    output.write('\n')
+
+
+def expand_path(path):
+    # Tilde cant be correctly parsed to user by the cwl-tool
+    return os.path.expanduser(path) if '~' in path else path
+
+
+"""
+    Value of a port as it is passed to the tool. The values of the editor are
+    written for a shell (e.g. '{print $3}' for awk), so quotes are resolved the
+    way the shell would, see FlowParser.tool_argv. A value which is split into
+    several arguments becomes a list.
+"""
+def port_arguments(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        arguments = shlex.split(value)
+    except ValueError:
+        return value
+    return arguments[0] if len(arguments) == 1 else arguments
+
+
 """
     Class containing all the logic required to parse *.flow-Files into
     a corresponding representation of the Common Workflow Language (CWL)
     Specification.
-    Currently the CWL Specification version used in this project is v1.0
+    Currently the CWL Specification version used in this project is v1.1
+    The CWL documents are built as objects and only serialized as a whole, either
+    as one file per step together with the workflow file, as a single packed
+    document ($graph) or not at all, when they are handed to an in-process runner.
 """
 class FlowToCWLParser:
     """
         Makes use of the FlowParser class with slight changes at certain steps
         to fit the CWL definition and workflow
     """
-    def __init__(self, flow_file_path):
-        fp = FlowParser(flow_file_path)
-        fp.transform_nodes()
-        self.nodes = fp.nodes
-        self.connections = fp.connections
+    def __init__(self, flow_file_path, tracer=None, fuse=False):
+        self.tracer = tracer or Tracer(enabled=False)
+        self.fuse = fuse
+        # A plan holds the steps parsed before, the flow itself is not loaded
+        self.plan = load_plan(flow_file_path, self.tracer) if is_plan(flow_file_path) else None
+        if self.plan is None:
+            fp = FlowParser(flow_file_path, self.tracer)
+            fp.transform_nodes()
+            self.name = os.path.splitext(os.path.basename(flow_file_path))[0]
+        else:
+            fp = None
+            self.name = self.plan['name']
+        self.flow_parser = fp
+        self.graph = fp.graph if fp is not None else None
+        self.nodes = fp.nodes if fp is not None else None
+        self.connections = fp.connections if fp is not None else None
 
         self.steps = []
+        self.step_kinds = []
+        self.base_commands = []
+        # Arguments of the steps which are executed as a pipeline by the shell
+        self.step_arguments = []
+        # Resource hints of the tools of each step, see flow_graph.RESOURCE_KEYS
+        self.step_resources = []
         self.workflow_input_list = []
         self.workflow_job_values = []
         self.workflow_output_list = []
-    
+        # Inputs of each step which are connected to the output of another step
+        self.workflow_sources = []
+        # Node (and port index) every input of the workflow has been taken from,
+        # the index is None for the path of a FileInput or FileOutput
+        self.input_targets = {}
+
     """
         Function to construct the parameter input file (*.yml) required for the
-        CWL. Transforms the data into a corresponding dictionary for later parsing into 
+        CWL. Transforms the data into a corresponding dictionary for later parsing into
         the yaml-file.
     """
     def constructCWLInput(self, name, type, input_position, shortName=None, current_step=None):
@@ -44,263 +159,412 @@ class FlowToCWLParser:
 
         cwl_input[constructed_name]['inputBinding'] = {'position': input_position}
         if 'arg' not in name:
-            if shortName != None:
-                cwl_input[constructed_name]['inputBinding'] = {**cwl_input[constructed_name]['inputBinding'], 'prefix': f'-{shortName}'}
-            else:
-                cwl_input[constructed_name]['inputBinding'] = {**cwl_input[constructed_name]['inputBinding'], 'prefix': f'-{name}'}
+            # Same option FlowParser.tool_command uses if the port has no short name
+            prefix = f'-{shortName}' if shortName else f'--{name}'
+            cwl_input[constructed_name]['inputBinding']['prefix'] = prefix
         return cwl_input
 
+    """
+        Unique name of a step, which is also a valid CWL identifier. used maps
+        every name to the number of steps which have been named after it.
+    """
+    def step_name(self, name, used):
+        name = re.sub(r'\W', '_', name) or 'step'
+        unique_name = name
+        while unique_name in used:
+            used[name] += 1
+            unique_name = f'{name}_{used[name]}'
+        used[unique_name] = 1
+        used.setdefault(name, 1)
+        return unique_name
+
     """
         Parsing the required information to create the *.yml-Parameter File as well
-        as the job information files for each step (CommandLineTool class) and the
-        overarching Workflow class file (both *.cwl) containing each step and their 
-        inputs / outputs
+        as the job information for each step (CommandLineTool class) and the
+        overarching Workflow class containing each step and their inputs / outputs.
+        A piped input is the stdin of the step, an artificial dependency is an
+        input file of the step which is not passed to the tool, it only orders the steps.
     """
     def parse_commands(self):
-        prev_node_stdout = None
-        prev_node_dependency = None
+        self.steps = []
+        self.step_kinds = []
+        self.base_commands = []
+        self.step_arguments = []
+        self.step_resources = []
+        self.workflow_input_list = []
+        self.workflow_job_values = []
+        self.workflow_output_list = []
+        self.workflow_sources = []
+        self.input_targets = {}
+        used_names = {}
+        # Outputs other steps can consume, indexed by node id
+        stdout_sources = {}
+        dependency_sources = {}
         for node in self.nodes:
+            stream_source = self.graph.stream_source(node)
             # Currently we only consider FileInput, FileOutput and ToolNode
-            if node['model']['name'] == 'FileInput':
-                self.steps.append('cat')
-                self.workflow_input_list.append([
-                    { 'cat_path': { 'type': 'File', 'inputBinding': { 'position': 0}}}
-                    ])
-
-                input_file_path = node["model"]["path"]
-                if '~' in input_file_path:
-                    input_file_path = os.path.expanduser(input_file_path)
-
-                self.workflow_job_values.append([{ 'cat_path': {'class': 'File', 'path': input_file_path }}])
-                self.workflow_output_list.append([{ 'name': 'cat_stdout', 'type': 'stdout' }])
-                # Set Flag for next node to know it will receive stdin
-                prev_node_stdout = {'node_id': node['id'], 'name': 'cat_stdout'}
-            
-            elif node['model']['name'] == 'FileOutput':
-                fileoutput_inputs = []
-                if prev_node_stdout != None:
-                    for cnn in self.connections:
-                        if cnn['out_id'] == prev_node_stdout['node_id'] and cnn['out_index'] == 1 and cnn['in_id'] == node['id']:
-                            fileoutput_inputs.append({
-                                prev_node_stdout['name']: {'type': 'stdin'}
-                            })
-                    prev_node_stdout = None
-
-                self.steps.append('print')
-                fileoutput_inputs.append(
-                    { 'print_outputFilePath': { 'type': 'File', 'inputBinding': { 'position': 0}}}
-                    )
-                self.workflow_input_list.append(fileoutput_inputs)
-
-                output_file_path = node["model"]["outputFilePath"]
-                if '~' in output_file_path:
-                    output_file_path = os.path.expanduser(output_file_path)
-
-                self.workflow_job_values.append([{ 'print_outputFilePath': {'class': 'File', 'path': output_file_path }}])
-                self.workflow_output_list.append([])
-                
-            elif node['model']['name'] == 'ToolNode':
-                input_cwl_list = []
-                input_job_values = []
-
-                if prev_node_stdout != None:
-                    for cnn in self.connections:
-                        if cnn['out_id'] == prev_node_stdout['node_id'] and cnn['in_id'] == node['id'] and cnn['in_index'] == 4:
-                            input_cwl_list.append({
-                                prev_node_stdout['name']: {'type': 'stdin'}
-                            })
-                    prev_node_stdout = None
-                
-                if prev_node_dependency != None:
-                    for cnn in self.connections:
-                        if cnn['out_id'] == prev_node_dependency['node_id'] and cnn['in_id'] == node['id'] and cnn['in_index'] == 0:
-                            input_cwl_list.append({
-                                prev_node_dependency['name']: {'type': 'stdin'}
-                            })
-                    prev_node_dependency = None
-
-                # Extract shell command
-                step_name = node['model']['tool']['path'].strip()
-                self.steps.append(step_name)
-                # Extract all port values from the ports of the ToolNode
-                ports = node['model']['tool']['ports']
-                arguments = [
-                    {
-                        'key': port['name'], 'value': port['value'],
-                        'type': port['type'], 'position': port['position'],
-                        'shortName': port['shortName']
-                    } for port in ports if port['value'] != None and port['value']
-                ]
+            if node.kind not in ('FileInput', 'FileOutput', 'ToolNode'):
+                continue
+            input_cwl_list = []
+            input_job_values = []
+            output_list = []
+            sources = {}
+
+            if node.kind == 'FileInput':
+                step_name = self.step_name('cat', used_names)
+                base_command = ['cat']
+                input_cwl_list.append({f'{step_name}_path': {'type': 'File', 'inputBinding': {'position': 0}}})
+                input_job_values.append({f'{step_name}_path': {'class': 'File', 'path': expand_path(node.path)}})
+                self.input_targets[f'{step_name}_path'] = (node.id, None)
+                output_list.append({'name': f'{step_name}_stdout', 'type': 'stdout'})
+                stdout_sources[node.id] = f'{step_name}/{step_name}_stdout'
+
+            elif node.kind == 'FileOutput':
+                step_name = self.step_name('print', used_names)
+                base_command = ['xargs', 'echo']
+                if stream_source is not None and stream_source.id in stdout_sources:
+                    input_cwl_list.append({f'{step_name}_stdin': {'type': 'stdin'}})
+                    sources[f'{step_name}_stdin'] = stdout_sources[stream_source.id]
+                input_cwl_list.append(
+                    {f'{step_name}_outputFilePath': {'type': 'File', 'inputBinding': {'position': 0}}})
+                input_job_values.append(
+                    {f'{step_name}_outputFilePath': {'class': 'File', 'path': expand_path(node.path)}})
+                self.input_targets[f'{step_name}_outputFilePath'] = (node.id, None)
+
+            else:
+                # Extract the command of the tool
+                base_command = shlex.split(node.path)
+                step_name = self.step_name(os.path.basename(base_command[0]) if base_command else '', used_names)
+
+                if stream_source is not None and stream_source.id in stdout_sources:
+                    input_cwl_list.append({f'{step_name}_stdin': {'type': 'stdin'}})
+                    sources[f'{step_name}_stdin'] = stdout_sources[stream_source.id]
+
+                # Check if the ToolNode depends on the artificial output of another step
+                dependency_port = None
+                for port in node.ports:
+                    if port.type != 'dependency':
+                        continue
+                    if port.direction == 'out':
+                        dependency_port = port
+                        continue
+                    for edge in self.graph.edges_to(node.id, port.index):
+                        if edge.out_id in dependency_sources:
+                            name = f'{step_name}_after{len(sources)}'
+                            input_cwl_list.append({name: {'type': 'File'}})
+                            sources[name] = dependency_sources[edge.out_id]
+
                 # Check if the ToolNode's stdout has a connection to another input
-                output_appended = False
-                dependency_info = None
-                for port in ports:
-                    if port['type'] == 'dependency':
-                        dependency_info = port
-                    if port['name'] == 'stdout':
-                        stdout_index = port['port_index']
-                        for cnn in self.connections:
-                            if cnn['out_id'] == node['id'] and cnn['out_index'] == stdout_index:
-                                self.workflow_output_list.append([{ 'name': f'{step_name}_stdout',  'type': 'stdout' }])
-                                output_appended = True
-                                prev_node_stdout = {'node_id': node['id'], 'name': f'{step_name}_stdout'}
-                if not output_appended:
-                    # Artificial Dependency through params
-                    dependency_port_index = dependency_info['port_index']
-                    inserted_output = False
-                    for cnn in self.connections:
-                        if cnn['out_id'] == node['id'] and cnn['out_index'] == dependency_port_index:
-                            self.workflow_output_list.append([{'name': f'{step_name}_artificial',  'type': 'stdout'}])
-                            inserted_output = True
-                            prev_node_dependency = {'node_id': node['id'], 'name': f'{step_name}_artificial'}
-                    if not inserted_output:
-                        self.workflow_output_list.append(None)
-
-                for arg in arguments:                    
+                if node.stdout_index is not None and self.graph.edges_from(node.id, node.stdout_index):
+                    output_list.append({'name': f'{step_name}_stdout', 'type': 'stdout'})
+                    stdout_sources[node.id] = f'{step_name}/{step_name}_stdout'
+                # Artificial Dependency through params
+                elif dependency_port is not None and self.graph.edges_from(node.id, dependency_port.index):
+                    output_list.append({'name': f'{step_name}_artificial', 'type': 'stdout'})
+                    dependency_sources[node.id] = f'{step_name}/{step_name}_artificial'
+
+                # Extract all port values from the ports of the ToolNode
+                for port in node.arguments():
+                    value = port_arguments(port.value)
                     # Check if the value contains a dot, an indication for a file
                     # Required as CWL needs to use the 'File' type for actual files
                     # Using a string for the path of the file does not seem to work
-                    if isinstance(arg['value'], str) and '.' in arg['value']:
-                        cwl_input = self.constructCWLInput(
-                            name=arg['key'], type='File', 
-                            input_position=arg['position'], shortName=arg['shortName'],
-                            current_step=step_name)
+                    if isinstance(value, str) and '.' in value:
+                        port_type = 'File'
+                        value = {'class': 'File', 'path': expand_path(value)}
+                    elif isinstance(value, list):
+                        port_type = 'string[]'
+                    else:
+                        port_type = port.type
+                    input_cwl_list.append(self.constructCWLInput(
+                        name=port.name, type=port_type,
+                        input_position=port.position, shortName=port.short_name,
+                        current_step=step_name))
+                    input_job_values.append({f'{step_name}_{port.name}': value})
+                    self.input_targets[f'{step_name}_{port.name}'] = (node.id, port.index)
 
-                        input_cwl_list.append(cwl_input)
+            self.steps.append(step_name)
+            self.step_kinds.append(node.kind)
+            self.base_commands.append(base_command)
+            self.step_arguments.append(None)
+            self.step_resources.append(add_resources({}, node.resources))
+            self.workflow_input_list.append(input_cwl_list)
+            self.workflow_job_values.append(input_job_values)
+            self.workflow_output_list.append(output_list)
+            self.workflow_sources.append(sources)
 
-                        correct_file_path = arg['value']
-                        # Tilde cant be correctly parsed to user by the cwl-tool
-                        if '~' in correct_file_path:
-                            correct_file_path = os.path.expanduser(correct_file_path)
-                        input_job_values.append({f'{step_name}_{arg["key"]}': {'class': 'File', 'path': correct_file_path}})
+    """
+        Fuses linear chains of steps connected through stdout/stdin into a single
+        step. The tools of the chain are connected through pipes by the shell
+        (ShellCommandRequirement), so the intermediate streams are never written
+        to the disk and staged into the next step. A stream is only fused if the
+        step reading it as its stdin is its only consumer. The step fails if any of
+        its tools fails, not only the last one (see PIPEFAIL_OPEN).
+    """
+    def fuse_pipelines(self):
+        step_index = {step: idx for idx, step in enumerate(self.steps)}
+        readers = {}
+        stdin_sources = {}
+        for idx, sources in enumerate(self.workflow_sources):
+            for param, source in sources.items():
+                readers[source] = readers.get(source, 0) + 1
+                if param == f'{self.steps[idx]}_stdin':
+                    stdin_sources[idx] = source
 
+        next_stage = {}
+        for idx, source in stdin_sources.items():
+            producer = step_index[source.split('/')[0]]
+            if (self.step_kinds[idx] == 'ToolNode' and self.step_kinds[producer] in ('FileInput', 'ToolNode')
+                    and readers[source] == 1 and len(self.workflow_output_list[producer]) == 1):
+                next_stage[producer] = idx
+        if not next_stage:
+            return
+
+        fused_stages = set(next_stage.values())
+        old = (self.steps, self.step_kinds, self.base_commands, self.step_arguments, self.step_resources,
+               self.workflow_input_list, self.workflow_job_values, self.workflow_output_list, self.workflow_sources)
+        fused = ([], [], [], [], [], [], [], [], [])
+        # The outputs of the last tool of a pipeline are now produced by the pipeline
+        renamed_sources = {}
+        for idx in range(len(self.steps)):
+            if idx in fused_stages:
+                continue
+            stages = [idx]
+            while stages[-1] in next_stage:
+                stages.append(next_stage[stages[-1]])
+            if len(stages) == 1:
+                for values, old_values in zip(fused, old):
+                    values.append(old_values[idx])
+                continue
+
+            step_name = f'{self.steps[stages[0]]}_to_{self.steps[stages[-1]]}'
+            for output in self.workflow_output_list[stages[-1]]:
+                renamed_sources[f'{self.steps[stages[-1]]}/{output["name"]}'] = f'{step_name}/{output["name"]}'
+            arguments = [{'position': 0, 'valueFrom': PIPEFAIL_OPEN, 'shellQuote': False}]
+            input_cwl_list = []
+            input_job_values = []
+            sources = {}
+            for stage_idx, stage in enumerate(stages):
+                position = (stage_idx + 1) * STAGE_POSITIONS
+                if stage_idx > 0:
+                    separator = PIPEFAIL_LAST if stage_idx == len(stages) - 1 else PIPEFAIL_NEXT
+                    arguments.append({'position': position - 1, 'valueFrom': separator, 'shellQuote': False})
+                for token_idx, token in enumerate(self.base_commands[stage]):
+                    # Literal values must not be evaluated as parameter references
+                    token = token.replace('$(', '\\$(').replace('${', '\\${')
+                    arguments.append({'position': position + token_idx, 'valueFrom': token})
+                for cwl_input in self.workflow_input_list[stage]:
+                    for param, definition in cwl_input.items():
+                        # Except for the first tool, stdin is the pipe from the previous tool
+                        if stage_idx > 0 and param == f'{self.steps[stage]}_stdin':
+                            continue
+                        definition = copy.deepcopy(definition)
+                        if 'inputBinding' in definition:
+                            definition['inputBinding']['position'] += position + STAGE_INPUT_OFFSET
+                        input_cwl_list.append({param: definition})
+                        if param in self.workflow_sources[stage]:
+                            sources[param] = self.workflow_sources[stage][param]
+                input_job_values += self.workflow_job_values[stage]
+            arguments.append({'position': (len(stages) + 1) * STAGE_POSITIONS, 'valueFrom': PIPEFAIL_CLOSE,
+                              'shellQuote': False})
+
+            # The tools of the pipeline run at the same time
+            resources = {}
+            for stage in stages:
+                add_resources(resources, self.step_resources[stage])
+            for values, value in zip(fused, (step_name, 'Pipeline', [], arguments, resources, input_cwl_list,
+                                             input_job_values, self.workflow_output_list[stages[-1]], sources)):
+                values.append(value)
+
+        (self.steps, self.step_kinds, self.base_commands, self.step_arguments, self.step_resources,
+         self.workflow_input_list, self.workflow_job_values, self.workflow_output_list, self.workflow_sources) = fused
+        for sources in self.workflow_sources:
+            for param, source in sources.items():
+                sources[param] = renamed_sources.get(source, source)
+
+    def tool_definition(self, idx):
+        if self.step_arguments[idx] is not None:
+            tool = {'class': 'CommandLineTool', 'requirements': [{'class': 'ShellCommandRequirement'}],
+                    'arguments': self.step_arguments[idx], 'inputs': {}, 'outputs': {}}
+        else:
+            tool = {'class': 'CommandLineTool', 'baseCommand': self.base_commands[idx], 'inputs': {}, 'outputs': {}}
+        for cwl_input in self.workflow_input_list[idx]:
+            tool['inputs'].update(cwl_input)
+        for output in self.workflow_output_list[idx]:
+            tool['outputs'][output['name']] = {'type': output['type']}
+        if any(output['type'] == 'stdout' for output in self.workflow_output_list[idx]):
+            tool['stdout'] = f'{self.steps[idx]}_output.txt'
+        # Passed as a hint, so a runner on a smaller machine still executes the step
+        if self.step_resources[idx]:
+            tool['hints'] = [{'class': 'ResourceRequirement', **{CWL_RESOURCES[key]: value
+                                                                 for key, value in self.step_resources[idx].items()}}]
+        return tool
+
+    """
+        The overarching Workflow, run returns what is run by the step of the given
+        index: the path of its file, a reference into a packed document or the
+        tool definition itself
+    """
+    def workflow_definition(self, run):
+        wf_inputs = {}
+        wf_steps = {}
+        for idx, step in enumerate(self.steps):
+            step_inputs = {}
+            for cwl_input in self.workflow_input_list[idx]:
+                for param, definition in cwl_input.items():
+                    if param in self.workflow_sources[idx]:
+                        step_inputs[param] = self.workflow_sources[idx][param]
                     else:
-                        cwl_input = self.constructCWLInput(
-                            name=arg['key'], type=arg['type'], 
-                            input_position=arg['position'], shortName=arg['shortName'], 
-                            current_step=step_name)
-
-                        input_cwl_list.append(cwl_input)
-                        input_job_values.append({f'{step_name}_{arg["key"]}': arg['value']})
-                self.workflow_input_list.append(input_cwl_list)
-                self.workflow_job_values.append(input_job_values)
-    
+                        wf_inputs[param] = definition['type']
+                        step_inputs[param] = param
+            wf_steps[step] = {
+                'run': run(idx),
+                'in': step_inputs,
+                'out': [output['name'] for output in self.workflow_output_list[idx]]
+            }
+        return {'class': 'Workflow', 'inputs': wf_inputs, 'outputs': {}, 'steps': wf_steps}
+
+    """
+        Workflow with the definitions of all tools embedded, used to hand the
+        flow to a runner without writing any files
+    """
+    def workflow_document(self):
+        return {'cwlVersion': CWL_VERSION, **self.workflow_definition(self.tool_definition)}
+
+    """
+        Single document containing the definitions of all tools and the workflow,
+        the workflow is the process called main
+    """
+    def packed_document(self):
+        graph = [{'id': step, **self.tool_definition(idx)} for idx, step in enumerate(self.steps)]
+        graph.append({'id': 'main', **self.workflow_definition(lambda idx: f'#{self.steps[idx]}')})
+        return {'cwlVersion': CWL_VERSION, '$graph': graph}
+
+    """
+        Runs the workflow once for every element of the array inputs in scattered
+        (dotproduct), all other inputs are the same for every run. The workflow of
+        the flow is the process called flow, the scattering workflow is main.
+    """
+    def scatter_document(self, scattered):
+        document = self.packed_document()
+        flow = document['$graph'][-1]
+        flow['id'] = 'flow'
+        inputs = {param: {'type': 'array', 'items': input_type} if param in scattered else input_type
+                  for param, input_type in flow['inputs'].items()}
+        document['$graph'].append({
+            'id': 'main',
+            'class': 'Workflow',
+            'requirements': [{'class': 'ScatterFeatureRequirement'}, {'class': 'SubworkflowFeatureRequirement'}],
+            'inputs': inputs,
+            'outputs': {},
+            'steps': {'flow': {'run': '#flow', 'in': {param: param for param in inputs}, 'out': [],
+                               'scatter': list(scattered), 'scatterMethod': 'dotproduct'}}
+        })
+        return document
+
+    """
+        Values of all inputs of the workflow (the content of the parameter file)
+    """
+    def job_order(self):
+        job_order = {}
+        for job_values in self.workflow_job_values:
+            for job_value in job_values:
+                job_order.update(job_value)
+        return job_order
+
+    """
+        Key of the generated tool and workflow definitions. It only depends on the
+        steps and their inputs / outputs, not on the job values of the parameter file,
+        so flows which only differ in their values share the same definitions.
+    """
+    def definitions_key(self):
+        normalized = json.dumps(self.workflow_document(), sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    """
+        Everything parse_commands has parsed from the flow, as it is stored in a plan
+    """
+    def compiled_state(self):
+        return {attribute: getattr(self, attribute) for attribute in COMPILED_ATTRIBUTES}
+
+    def restore(self, state):
+        for attribute in COMPILED_ATTRIBUTES:
+            setattr(self, attribute, state[attribute])
+
+    def compile(self):
+        with self.tracer.phase('parse_commands') as args:
+            if self.plan is None:
+                self.parse_commands()
+            else:
+                self.restore(marshal.loads(self.plan['cwl']))
+            if self.fuse:
+                self.fuse_pipelines()
+            args['steps'] = len(self.steps)
+
     """
         Function to create all the yml files required to
-        execute a CWL Workflow runner, based on the CWL v1.0 standard
+        execute a CWL Workflow runner, based on the CWL v1.1 standard
         3 types of file are required for our purposes:
-            1. CWL Files for each processing step, containing 
+            1. CWL Files for each processing step, containing
                 the command to be executed an required parameters
-            2. A single parameter file containing all 
+            2. A single parameter file containing all
                 the parameter required to run the processes
-            3. An overarching Workflow file, containing 
+            3. An overarching Workflow file, containing
                 all the steps to be executed in sequential orders and their required parameters
+        If packed is set, 1. and 3. are written into a single document instead.
+        The CWL cache stores the same files, see write_cache_entry.
     """
-    def create_workflow_files(self):
-        self.parse_commands()
-        # Standard opener for cwl command files
-        cwl_opener = ['#!/usr/bin/env cwl-runner\n\n',
-                          'cwlVersion: v1.1\n']
-
-        # 1. Create cwl files for each step in the workflow
-        dependent_inputs = []
-        for idx, step in enumerate(self.steps):
-            cwl_file_name = f'{step}.cwl'
-            cwl_basecommand = f'baseCommand: [{step}]\n'
-            cwl_stdout = ''
-            if step == 'print':
-                cwl_basecommand = f'baseCommand: [xargs, echo]\n'
-
-            if self.workflow_output_list[idx] != None:
-                for out in self.workflow_output_list[idx]:
-                    if out['type'] == 'stdout':
-                        cwl_stdout = f'stdout: {step}_output.txt\n'
-
-            cwl_inputs = {'inputs': self.workflow_input_list[idx] }
-            for step_input in cwl_inputs['inputs']:
-                key = list(step_input.keys())[0]
-                key_origin = key.split('_')[0]
-                if step_input[key]['type'] == 'stdin':
-                    dependent_inputs.append({'name': f'{key_origin}/{key}', 'belongsTo': step, 'param': key})
-            formatted_outputs = []
-
-            if self.workflow_output_list[idx] != None:
-                for elem in self.workflow_output_list[idx]:
-                    formatted_outputs.append({ elem['name']: { 'type': elem['type']}})
-            cwl_outputs = {'outputs': formatted_outputs }
-
-            with open(cwl_file_name, 'w') as output:
-                output.writelines(cwl_opener)
-                output.write('class: CommandLineTool\n')
-                output.write(cwl_basecommand)
-                output.write(cwl_stdout)
-
-                stream_input = yaml.dump(cwl_inputs, default_flow_style=False)
-                stream_output = yaml.dump(cwl_outputs, default_flow_style=False)
-                # Remove leading scores, but keep the ones for the prefix
-                output.write(stream_input.replace('- ', '  '))
-                output.write(stream_output.replace('- ', '  '))
-
-        wf_name = '-'.join(self.steps)
-        wf_steps= {}
-        wf_steps['steps'] = []
-
-        flattened_job_values = []
-        for sublist in self.workflow_job_values:
-            for item in sublist:
-                flattened_job_values.append(item)
+    def create_workflow_files(self, packed=False, output_dir=''):
+        self.compile()
 
         # 2. Create param inputs file
-        workflow_param_name = f'{wf_name}-params.yml'
+        workflow_param_name = os.path.join(output_dir, f'{self.name}-params.yml')
+        with self.tracer.phase('write_params_file'):
+            self.write_params_file(workflow_param_name)
+
+        with self.tracer.phase('write_definitions'):
+            return (self.write_definitions(output_dir, self.name, packed), workflow_param_name)
+
+    """
+        Writes everything a run of the flow needs into an entry of the CWL cache:
+        the definitions, the parameter file and the name and steps of the flow
+        (see read_cache_entry)
+    """
+    def write_cache_entry(self, entry_dir, packed=False):
+        self.compile()
+        self.write_definitions(entry_dir, 'flow', packed)
+        self.write_params_file(os.path.join(entry_dir, CACHED_PARAMS))
+        with open(os.path.join(entry_dir, CACHE_MANIFEST), 'w') as manifest_file:
+            json.dump({'name': self.name, 'steps': self.steps}, manifest_file)
+
+    def write_params_file(self, workflow_param_name):
         with open(workflow_param_name, 'w') as output:
-                stream = yaml.dump(flattened_job_values, default_flow_style=False)
-                stream = stream.replace('- ', '')
-                stream = stream.replace('\'\'\'', '\'')
-                output.write(stream)
-        
-        wf_inputs = []
-        input_keys = []
-        output_keys = []
-        for idx, lst in enumerate(self.workflow_input_list):
-            for param in lst:
-                current_param_key = list(param.keys())[0]
-                if not param[current_param_key]['type'] == 'stdin':
-                    input_keys.append(current_param_key)
-                    wf_inputs.append({ f'{current_param_key}': param[current_param_key]['type']})
-                else:
-                    output_keys.append(current_param_key)
-        for idx, step in enumerate(self.steps):
-            new_step = {}
+            dump_document(self.job_order(), output)
 
-            relevant_params = [{param: param} for param in input_keys if f'{step}_' in param]
+    @staticmethod
+    def definitions_path(output_dir, wf_name, packed=False):
+        return os.path.join(output_dir, f'{wf_name}-packed.cwl' if packed else f'{wf_name}-workflow.cwl')
 
-            for d_input in dependent_inputs:
-                if d_input['belongsTo'] == step:
-                    relevant_params.append({ d_input['param']: d_input['name']})
+    """
+        Writes the CWL files of all steps (1.) and the overarching workflow (3.),
+        or the packed document, into the output directory and returns the path of
+        the workflow file
+    """
+    def write_definitions(self, output_dir, wf_name, packed=False):
+        workflow_file_name = self.definitions_path(output_dir, wf_name, packed)
+        if packed:
+            documents = [(workflow_file_name, self.packed_document())]
+        else:
+            # 1. Create cwl files for each step in the workflow
+            documents = [(os.path.join(output_dir, f'{step}.cwl'),
+                          {'cwlVersion': CWL_VERSION, **self.tool_definition(idx)})
+                         for idx, step in enumerate(self.steps)]
+            # 3. Create overarching workflow.cwl
+            documents.append((workflow_file_name, {
+                'cwlVersion': CWL_VERSION, **self.workflow_definition(lambda idx: f'{self.steps[idx]}.cwl')}))
 
-            output_params = [param for param in output_keys if f'{step}_' in param]
-            new_step[step] = {
-                'run': f'{step}.cwl',
-                'in': relevant_params,
-                'out': f'{output_params}'
-            }
-            wf_steps['steps'].append(new_step)
-
-        # 3. Create overarching workflow.cwl
-        worflow_file_name = f'{wf_name}-workflow.cwl'
-        with open(worflow_file_name, 'w') as output:
-            output.writelines(cwl_opener)
-            output.write('class: Workflow\n')
-            
-            wf_params_stream = yaml.dump({'inputs': wf_inputs }, default_flow_style=False)
-            wf_params_stream = wf_params_stream.replace('-', ' ')
-            output.write(wf_params_stream)
-
-            output.write('outputs: []\n')
-
-            wf_step_stream = yaml.dump(wf_steps, default_flow_style=False)
-            wf_step_stream = wf_step_stream.replace('-', ' ')
-            wf_step_stream = wf_step_stream.replace("\'", '')
-            output.write(wf_step_stream)
-        
-        return (worflow_file_name, workflow_param_name)
+        for file_name, document in documents:
+            with open(file_name, 'w') as output:
+                output.write(CWL_OPENER)
+                dump_document(document, output)
+        return workflow_file_name
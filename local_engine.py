@@ -0,0 +1,222 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from checkpoint import Checkpoints, reusable_steps
+from flow_plan import parse_steps
+from resources import ResourcePool, learn_from_status, machine_budget, record_resources, step_demand
+from step_runner import run_step, shard_mode
+from step_store import StepStore, changed_files, files_size, snapshot
+from tracing import Tracer
+from workflow_status import WorkFlowStatus
+
+
+"""
+    Executes a single step, measures its runtime, writes its checkpoints and
+    reports its progress to the status of the workflow and the tracer.
+    With a StepStore the step is skipped if it is up to date, unless it is forced.
+"""
+def timed_step(idx, step, checkpoints, status, tracer, store=None, force=False):
+    name = f'task_{idx}'
+    before = snapshot(step)
+    checkpoints.save(name, 'RUNNING', step['command'])
+    status.stepStarted(name, step['command'])
+    wall_start = time.time()
+    start = time.perf_counter()
+    if store is not None:
+        result = store.run_step(step, force)
+    else:
+        result = {**run_step(step), 'skipped': False}
+    end = time.perf_counter()
+    tracer.step(name, wall_start, wall_start + end - start, result.get('usage'),
+                exit_code=result['returncode'], skipped=result['skipped'])
+
+    if result['returncode'] == 0:
+        outputs = changed_files(step, before)
+        checkpoints.save(name, 'COMPLETED', step['command'], outputs)
+        status.stepFinished(name, 0, files_size(outputs), result['skipped'], result.get('usage'))
+    else:
+        checkpoints.save(name, 'FAILED', step['command'])
+        status.stepFinished(name, result['returncode'], usage=result.get('usage'))
+    return {'step': idx, **result, 'start': start, 'end': end}
+
+
+"""
+    Process Engine executing the steps of a flow on the local machine,
+    without requiring a database. Steps are started as soon as all the steps
+    they depend on have finished, at most `jobs` steps run at the same time.
+    Line-parallel steps reading a large file are split into `shards` processes.
+    Steps are only started while the cores and RAM they need (see resources) fit
+    into what is left of the budget of `cores` and `ram` (MiB), which defaults to
+    this machine. Steps without hints of the flow use the resources they have
+    used in earlier runs in output_path.
+"""
+class LocalEngine:
+    def __init__(self, output_path, input_file_path, jobs=None, store=None, tracer=None, shards=None, steps=None,
+                 cores=None, ram=None):
+        self.state = WorkFlowStatus(output_path)
+        self.tracer = tracer or Tracer('local', enabled=False)
+        # Steps which have been parsed before (e.g. by a Sweep) are used as they are
+        self.steps = steps if steps is not None else parse_steps(input_file_path, self.tracer)
+        self.jobs = jobs or os.cpu_count()
+        if shards:
+            for step in self.steps:
+                step['shards'] = shards
+        self.store = store
+        self.checkpoints = Checkpoints(output_path)
+        self.budget = machine_budget()
+        self.budget.update({key: value for key, value in (('cores', cores), ('ram', ram)) if value})
+        learn_from_status(self.steps, self.state, self.tracer)
+
+    """
+        Executes all steps of the flow. When resuming, the steps which have
+        completed in the previous run are not executed again as long as their
+        outputs are unchanged, execution restarts at the first incomplete step.
+    """
+    def execute(self, resume=False):
+        results = {}
+        dependents = {idx: [] for idx in range(len(self.steps))}
+        remaining = {}
+        for idx, step in enumerate(self.steps):
+            remaining[idx] = len(step['depends_on'])
+            for dependency in step['depends_on']:
+                dependents[dependency].append(idx)
+
+        if resume:
+            reused = reusable_steps(self.steps, self.checkpoints)
+        else:
+            reused = set()
+            self.checkpoints.clear()
+
+        self.state.start(len(self.steps), len(reused))
+        start = time.perf_counter()
+        for idx in reused:
+            results[idx] = {'step': idx, 'returncode': 0, 'returncodes': [], 'skipped': True,
+                            'start': start, 'end': start}
+            for dependent in dependents[idx]:
+                remaining[dependent] -= 1
+        if reused:
+            print(f'Resuming after {len(reused)} completed steps')
+
+        failed = False
+        resources = ResourcePool(self.budget)
+        demands = [step_demand(step, shard_mode(step) is not None) for step in self.steps]
+        # Steps whose dependencies have all finished, with whether they have to run again
+        ready = {idx: False for idx, count in remaining.items() if count == 0 and idx not in reused}
+        running = {}
+        with self.tracer.phase('execute', jobs=self.jobs, **self.budget), \
+                ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while ready or running:
+                # The largest steps are started first, smaller ones fill up what is left of the budget
+                for idx in sorted(ready, key=lambda idx: (demands[idx]['cores'], demands[idx]['ram']), reverse=True):
+                    if len(running) >= self.jobs:
+                        break
+                    if not resources.fits(demands[idx]):
+                        continue
+                    resources.acquire(demands[idx])
+                    running[pool.submit(timed_step, idx, self.steps[idx], self.checkpoints, self.state,
+                                        self.tracer, self.store, ready.pop(idx))] = idx
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    resources.release(demands[running.pop(future)])
+                    result = future.result()
+                    results[result['step']] = result
+                    if result['returncode'] != 0:
+                        print(f'task_{result["step"]} failed with exit codes {result["returncodes"]}')
+                        failed = True
+                    # Dependents of a failed step are never started
+                    if failed:
+                        continue
+                    for dependent in dependents[result['step']]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            # Steps downstream of an executed step always run again
+                            ready[dependent] = any(not results[dep]['skipped']
+                                                   for dep in self.steps[dependent]['depends_on'])
+        wall_time = time.perf_counter() - start
+
+        if failed or len(results) < len(self.steps):
+            self.state.saveState('ERROR')
+        else:
+            self.state.saveState('FINISHED')
+        record_resources(self.state)
+        return self.report(results, wall_time)
+
+    """
+        Computes the critical path through the executed steps, i.e. the chain of
+        dependent steps with the longest total runtime, and the achieved speedup
+        compared to running all steps one after another
+    """
+    def report(self, results, wall_time):
+        path_time = {}
+        path_previous = {}
+        # Results are processed in the order the steps finished, so all
+        # dependencies of a step have been processed before the step itself
+        for idx in sorted(results, key=lambda idx: results[idx]['end']):
+            duration = results[idx]['end'] - results[idx]['start']
+            previous = max((dep for dep in self.steps[idx]['depends_on'] if dep in path_time),
+                           key=lambda dep: path_time[dep], default=None)
+            path_previous[idx] = previous
+            path_time[idx] = duration + (path_time[previous] if previous is not None else 0)
+
+        critical_path = []
+        idx = max(path_time, key=lambda idx: path_time[idx], default=None)
+        critical_time = path_time.get(idx, 0)
+        while idx is not None:
+            critical_path.insert(0, idx)
+            idx = path_previous[idx]
+
+        serial_time = sum(result['end'] - result['start'] for result in results.values())
+        speedup = serial_time / wall_time if wall_time > 0 else 1.0
+        skipped = sum(1 for result in results.values() if result['skipped'])
+        print(f'Executed {len(results)}/{len(self.steps)} steps in {wall_time:.3f}s using {self.jobs} jobs')
+        if skipped:
+            print(f'Skipped {skipped} steps which were up to date')
+        print(f'Critical path: {" -> ".join(f"task_{idx}" for idx in critical_path)} ({critical_time:.3f}s)')
+        print(f'Parallel speedup: {speedup:.2f}x ({serial_time:.3f}s of serial work)')
+        return {
+            'results': [results[idx] for idx in sorted(results)],
+            'wall_time': wall_time,
+            'serial_time': serial_time,
+            'speedup': speedup,
+            'skipped': skipped,
+            'critical_path': critical_path,
+            'critical_path_time': critical_time
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute *.flow-Files on the local machine.')
+    parser.add_argument('-p', metavar='Execution Path', required=True)
+    parser.add_argument('-wf', metavar='Workflow Path',
+                        required=False, default=None)
+    parser.add_argument('-s', metavar='Status', required=False, default=None,
+                        help='"summary" prints the progress of all steps, otherwise only the state')
+    parser.add_argument('-j', '--jobs', metavar='Jobs', type=int, required=False, default=None)
+    parser.add_argument('-i', '--incremental', action='store_true')
+    parser.add_argument('--hash', action='store_true')
+    parser.add_argument('--resume', action='store_true')
+    parser.add_argument('--shards', metavar='Shards', type=int, required=False, default=None)
+    parser.add_argument('--cores', metavar='Cores', type=int, required=False, default=None)
+    parser.add_argument('--ram', metavar='RAM (MiB)', type=int, required=False, default=None)
+    parser.add_argument('--trace', metavar='Trace Path', required=False, default=None)
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], required=False, default='json')
+    args = parser.parse_args(argv)
+
+    # Execute Workflow / startCommand
+    if args.wf != None:
+        store = StepStore(args.p, args.hash) if args.incremental else None
+        tracer = Tracer('local', enabled=args.trace is not None)
+        engine = LocalEngine(args.p, args.wf, args.jobs, store, tracer, args.shards, cores=args.cores, ram=args.ram)
+        engine.execute(args.resume)
+        if args.trace != None:
+            tracer.write(args.trace, args.trace_format)
+    # Execute statusCommand
+    elif args.s != None:
+        ws = WorkFlowStatus(args.p)
+        print(ws.describe() if args.s == 'summary' else ws.getState())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import importlib
+import sys
+
+
+# Module of every Process Engine, only the one which is used gets imported
+ENGINES = {
+    'local': 'local_engine',
+    'cwl': 'cwl_engine',
+    'fireworks': 'firework_engine'
+}
+
+
+"""
+    Prints the state or the summary of a run. Only the summary file is read,
+    no Process Engine is imported, so the status can be polled cheaply.
+"""
+def print_status(path, summary=False):
+    from workflow_status import WorkFlowStatus
+    ws = WorkFlowStatus(path)
+    try:
+        print(ws.describe() if summary else ws.getState())
+    except (FileNotFoundError, ValueError) as e:
+        print(f'No status of a workflow in {path}: {e}', file=sys.stderr)
+        return 1
+    return 0
+
+
+def status(args, options):
+    return print_status(args.p, args.summary)
+
+
+"""
+    Executes the flow with the given engine, all further options are passed
+    on to the engine (e.g. -j for local, --inprocess for cwl, -dbhost for fireworks)
+"""
+def run(args, options):
+    engine = importlib.import_module(ENGINES[args.engine])
+    engine.main(['-p', args.p, '-wf', args.wf] + options)
+    return 0
+
+
+"""
+    Generates the CWL documents of a flow without executing them, or with --plan
+    the plan of the flow, which all engines execute instead of the flow itself
+"""
+def compile(args, options):
+    if args.plan:
+        import os
+        from flow_plan import compile_plan, plan_path
+        output_path = plan_path(os.path.join(args.o, os.path.basename(args.wf)) if args.o else args.wf)
+        compile_plan(args.wf, output_path)
+        print(output_path)
+        return 0
+
+    from flow_to_cwl_parser import FlowToCWLParser
+    cwl_parser = FlowToCWLParser(args.wf, fuse=args.fuse)
+    workflow_path, params_path = cwl_parser.create_workflow_files(packed=args.packed, output_dir=args.o)
+    print(workflow_path)
+    print(params_path)
+    return 0
+
+
+"""
+    Starts the daemon, all options are passed on to engine_daemon.py
+"""
+def serve(args, options):
+    import engine_daemon
+    engine_daemon.main(options)
+    return 0
+
+
+"""
+    Submits a flow to a running daemon and prints its run, or with --wait its final summary
+"""
+def submit(args, options):
+    import json
+    import engine_daemon
+    try:
+        result = engine_daemon.submit(args.socket, args.wf, args.wait)
+    except (OSError, RuntimeError) as e:
+        print(f'Submitting {args.wf} failed: {e}', file=sys.stderr)
+        return 1
+    print(json.dumps(result))
+    return 1 if result.get('state') == 'ERROR' else 0
+
+
+"""
+    Runs the benchmark suite, all options are passed on to benchmark.py
+"""
+def bench(args, options):
+    import benchmark
+    benchmark.main(options)
+    return 0
+
+
+"""
+    Executes a flow for every row of a table, all options are passed on to sweep.py
+"""
+def sweep(args, options):
+    import sweep
+    sweep.main(options)
+    return 0
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # The status is polled constantly, its usual form is answered without
+    # argparse, which alone takes longer to import than reading the status
+    if len(argv) in (3, 4) and argv[:2] == ['status', '-p'] and argv[3:] in ([], ['--summary']):
+        return print_status(argv[2], len(argv) == 4)
+
+    import argparse
+    parser = argparse.ArgumentParser(description='Execute *.flow-Files with one of the Process Engines.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Execute a flow, further options are passed to the engine')
+    run_parser.add_argument('engine', choices=list(ENGINES))
+    run_parser.add_argument('-p', metavar='Execution Path', required=True)
+    run_parser.add_argument('-wf', metavar='Workflow Path', required=True)
+    run_parser.set_defaults(handler=run, forward=True)
+
+    status_parser = subparsers.add_parser('status', help='Print the state of a run')
+    status_parser.add_argument('-p', metavar='Execution Path', required=True)
+    status_parser.add_argument('--summary', action='store_true',
+                               help='Print the progress of all steps instead of only the state')
+    status_parser.set_defaults(handler=status, forward=False)
+
+    compile_parser = subparsers.add_parser('compile', help='Generate the CWL documents or the plan of a flow')
+    compile_parser.add_argument('-wf', metavar='Workflow Path', required=True)
+    compile_parser.add_argument('-o', metavar='Output Path', required=False, default='')
+    compile_parser.add_argument('--packed', action='store_true')
+    compile_parser.add_argument('--fuse', action='store_true')
+    compile_parser.add_argument('--plan', action='store_true', help='Write the plan of the flow')
+    compile_parser.set_defaults(handler=compile, forward=False)
+
+    serve_parser = subparsers.add_parser('serve', help='Start the daemon, options are passed to engine_daemon.py')
+    serve_parser.set_defaults(handler=serve, forward=True)
+
+    submit_parser = subparsers.add_parser('submit', help='Submit a flow to the daemon')
+    submit_parser.add_argument('-wf', metavar='Workflow Path', required=True)
+    submit_parser.add_argument('-socket', metavar='Socket Path', required=False, default='.process-engines.sock')
+    submit_parser.add_argument('--wait', action='store_true')
+    submit_parser.set_defaults(handler=submit, forward=False)
+
+    bench_parser = subparsers.add_parser('bench', help='Run the benchmarks, options are passed to benchmark.py')
+    bench_parser.set_defaults(handler=bench, forward=True)
+
+    sweep_parser = subparsers.add_parser('sweep', help='Execute a flow for every row of a table, '
+                                                       'options are passed to sweep.py')
+    sweep_parser.set_defaults(handler=sweep, forward=True)
+
+    args, options = parser.parse_known_args(argv)
+    if options and not args.forward:
+        parser.error(f'unrecognized arguments: {" ".join(options)}')
+    return args.handler(args, options)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+import math
+import os
+
+
+MIB = 1 << 20
+
+
+"""
+    Adds the hints of a tool to the resources of a step. The tools of a step run
+    at the same time as a pipeline, so their hints add up.
+"""
+def add_resources(resources, hints):
+    for key, value in (hints or {}).items():
+        resources[key] = resources.get(key, 0) + value
+    return resources
+
+
+"""
+    CPU cores and RAM in MiB of this machine, the cores this process may use
+"""
+def machine_budget():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        ram = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // MIB
+    except (AttributeError, ValueError, OSError):
+        ram = None
+    return {'cores': cores, 'ram': ram}
+
+
+"""
+    Resources every step has used in the past runs of the journal, indexed by the
+    command of the step. The cores are the CPU time of the step divided by its
+    runtime, the RAM is the sum of the peak RSS of its processes, as long as it
+    is known (see tracing.child_usage). The latest run of a command counts,
+    skipped steps have not used anything.
+"""
+def measured_resources(events):
+    commands = {}
+    started = {}
+    measured = {}
+    for event in events:
+        if event['event'] == 'step_started':
+            commands[event['step']] = event.get('command')
+            started[event['step']] = event['time']
+        elif event['event'] == 'step_finished':
+            command = commands.pop(event['step'], None)
+            start = started.pop(event['step'], None)
+            usage = event.get('usage')
+            if command is None or start is None or usage is None or event['skipped']:
+                continue
+            wall = event['time'] - start
+            measured[command] = {'cores': max(1, round(usage['cpu'] / wall)) if wall > 0 else 1}
+            if usage.get('max_rss') is not None:
+                measured[command]['ram'] = max(1, math.ceil(usage['max_rss'] / MIB))
+    return measured
+
+
+"""
+    Completes the resources of the steps with the measurements of past runs,
+    hints given in the flow take precedence
+"""
+def learn_resources(steps, measured):
+    learned = 0
+    for step in steps:
+        usage = measured.get(step['command'])
+        if usage is None:
+            continue
+        resources = step.setdefault('resources', {})
+        for key, value in usage.items():
+            if key not in resources:
+                resources[key] = value
+        learned += 1
+    return learned
+
+
+"""
+    Learns the resources of the steps from the runs before in the directory of
+    the status, as kept by record_resources
+"""
+def learn_from_status(steps, status, tracer):
+    with tracer.phase('learn_resources') as args:
+        args['steps'] = learn_resources(steps, status.getResources())
+
+
+"""
+    Keeps the resources the steps of the latest run have used for the runs to
+    come. Only the events of that run are read from the journal, so the time it
+    takes does not grow with the number of runs in the directory.
+"""
+def record_resources(status):
+    try:
+        measured = measured_resources(status.runEvents())
+    except FileNotFoundError:
+        return
+    if measured:
+        status.saveResources(measured)
+
+
+"""
+    What a step occupies of the budget while it is running: at least one core,
+    or one per shard of a sharded step, and no RAM unless it is known
+"""
+def step_demand(step, sharded=False):
+    resources = step.get('resources') or {}
+    cores = max(resources.get('cores', 1), step.get('shards', 1) if sharded else 1)
+    return {'cores': cores, 'ram': resources.get('ram', 0)}
+
+
+"""
+    Keeps track of the cores and RAM of a budget which are taken by running steps.
+    A step fits if all of its demand is free. A step asking for more than the
+    whole budget fits once nothing else is running, so it is never starved.
+"""
+class ResourcePool:
+    def __init__(self, budget):
+        self.budget = {key: budget.get(key) for key in ('cores', 'ram')}
+        self.taken = {'cores': 0, 'ram': 0}
+        self.running = 0
+
+    def fits(self, demand):
+        if self.running == 0:
+            return True
+        return all(self.budget[key] is None or self.taken[key] + demand[key] <= self.budget[key]
+                   for key in self.taken)
+
+    def acquire(self, demand):
+        for key in self.taken:
+            self.taken[key] += demand[key]
+        self.running += 1
+
+    def release(self, demand):
+        for key in self.taken:
+            self.taken[key] -= demand[key]
+        self.running -= 1
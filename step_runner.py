@@ -0,0 +1,401 @@
+import contextlib
+import mmap
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+
+from flow_graph import LINE_PARALLEL_MODES
+from tracing import child_usage, combine_usage, io_counters
+
+
+# Smallest part of the stdin of a line-parallel step worth a process of its own
+MIN_SHARD_SIZE = 1 << 20
+# Short options of sort taking a value, attached to the option or as the next argument
+SORT_VALUE_OPTIONS = 'kotST'
+
+
+"""
+    Raised by execute_step if a step has failed, keeps the exit codes of the pipeline
+"""
+class StepError(RuntimeError):
+    def __init__(self, step, result):
+        super().__init__(f'Step {step["command"]!r} failed with exit codes {result["returncodes"]}')
+        self.returncode = result['returncode']
+        self.returncodes = result['returncodes']
+
+
+def expand_path(path):
+    return os.path.expanduser(path) if path.startswith('~') else path
+
+
+"""
+    Copies the whole content of one file descriptor into another. The data is
+    copied inside of the kernel using copy_file_range or sendfile where possible,
+    only if both are unavailable it is copied through userspace.
+"""
+def copy_fd(src_fd, dst_fd, chunk_size=1 << 30):
+    for copy in (getattr(os, 'copy_file_range', None), os.sendfile):
+        if copy is None:
+            continue
+        copied_any = False
+        try:
+            while True:
+                if copy is os.sendfile:
+                    copied = os.sendfile(dst_fd, src_fd, None, chunk_size)
+                else:
+                    copied = copy(src_fd, dst_fd, chunk_size)
+                if copied == 0:
+                    return
+                copied_any = True
+        except OSError:
+            # Not supported for this pair of files, try the next way of copying
+            if copied_any:
+                raise
+
+    with os.fdopen(os.dup(src_fd), 'rb') as src, os.fdopen(os.dup(dst_fd), 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def copy_file(src_path, dst_path):
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        copy_fd(src.fileno(), dst.fileno())
+
+
+"""
+    Redirects everything the process and its children print into the log file,
+    on the level of the file descriptors, so the output of the tools is included
+"""
+@contextlib.contextmanager
+def redirected_output(log_path):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    with open(log_path, 'ab') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+
+
+"""
+    Waits for a process of a pipeline and measures its resource usage. The
+    process is only reaped after its I/O counters have been read.
+"""
+def wait_process(process):
+    try:
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        io = io_counters(process.pid)
+        _, status, rusage = os.wait4(process.pid, 0)
+    except (AttributeError, ChildProcessError):
+        # waitid is not available on every platform
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, child_usage(rusage, io)
+
+
+"""
+    Starts the processes of a pipeline, connected directly through OS pipes.
+    Every process is appended to processes as soon as it has been started.
+"""
+def start_pipeline(pipeline, stdin, stdout, processes, cwd=None):
+    previous = stdin
+    for idx, argv in enumerate(pipeline):
+        last = idx == len(pipeline) - 1
+        process = subprocess.Popen(
+            [expand_path(arg) for arg in argv], cwd=cwd, stdin=previous,
+            stdout=stdout if last else subprocess.PIPE)
+        # The read end of the pipe now belongs to the process alone,
+        # so the previous process receives SIGPIPE if it stops reading
+        if previous is not None and previous is not stdin:
+            previous.close()
+        previous = process.stdout
+        processes.append(process)
+
+
+"""
+    Exit code of a pipeline, a process which is stopped by SIGPIPE because a
+    later process of the pipeline finished reading early (e.g. head) has not failed
+"""
+def pipeline_returncode(returncodes):
+    returncodes_failed = [code for code in returncodes[:-1] if code != -signal.SIGPIPE] + returncodes[-1:]
+    return next((code for code in returncodes_failed if code != 0), 0)
+
+
+"""
+    Merge mode of a step whose stdin can be split into shards of lines: every tool
+    of its pipeline has to be line-parallel. The outputs of the shards are
+    concatenated ('lines'), only the last tool may be a sort, whose outputs are
+    merged with sort -m ('sort'). Returns None for all other steps.
+"""
+def shard_mode(step):
+    modes = step.get('parallel') or []
+    if not step['stdin'] or not step['pipeline'] or len(modes) != len(step['pipeline']):
+        return None
+    if any(mode != 'lines' for mode in modes[:-1]) or modes[-1] not in LINE_PARALLEL_MODES:
+        return None
+    return modes[-1]
+
+
+"""
+    Argument list of a sort without the file it writes its output into (-o, --output).
+    The shards of a sort write into their own temporary files, only the merge
+    writes the output.
+"""
+def without_sort_output(argv):
+    stripped = [argv[0]]
+    args = iter(argv[1:])
+    for arg in args:
+        if arg == '--':
+            stripped += [arg, *args]
+            break
+        if arg.startswith('--'):
+            name = arg[2:].split('=', 1)[0]
+            # Long options can be abbreviated, output is the only one starting with o
+            if name and 'output'.startswith(name):
+                if '=' not in arg:
+                    next(args, None)
+                continue
+        elif arg.startswith('-') and len(arg) > 1:
+            for idx in range(1, len(arg)):
+                if arg[idx] not in SORT_VALUE_OPTIONS:
+                    continue
+                attached = idx + 1 < len(arg)
+                if arg[idx] == 'o':
+                    if not attached:
+                        next(args, None)
+                    # Options in front of it in the same argument (e.g. -ro FILE) are kept
+                    arg = arg[:idx] if idx > 1 else None
+                elif not attached:
+                    stripped.append(arg)
+                    arg = next(args, None)
+                break
+            if arg is None:
+                continue
+        stripped.append(arg)
+    return stripped
+
+
+"""
+    Splits data into at most shards byte ranges of roughly the same size,
+    every range ends at the end of a line
+"""
+def line_chunks(data, shards):
+    size = len(data)
+    bounds = [0]
+    for idx in range(1, shards):
+        newline = data.find(b'\n', max(size * idx // shards, bounds[-1]))
+        if newline == -1 or newline + 1 >= size:
+            break
+        if newline + 1 > bounds[-1]:
+            bounds.append(newline + 1)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+"""
+    Writes a range of the mapped input into the stdin of the first process of a
+    shard, straight out of the page cache without copying it
+"""
+def feed_shard(pipe, data, start, end):
+    try:
+        with memoryview(data)[start:end] as chunk:
+            pipe.write(chunk)
+    except BrokenPipeError:
+        # The shard stopped reading early (e.g. head)
+        pass
+    finally:
+        try:
+            pipe.close()
+        except BrokenPipeError:
+            pass
+
+
+"""
+    Executes a line-parallel step (see shard_mode) as independent copies of its
+    pipeline. The stdin file is mapped into memory and split into one range of
+    whole lines for every copy. Every copy writes into a temporary file next to
+    the output of the step, these are concatenated or merged with sort -m into
+    the output once all copies have finished.
+"""
+def run_sharded_step(step, stdin_path, outputs, shards, mode, cwd=None):
+    output_dir = os.path.dirname(os.path.abspath(outputs[0])) if outputs else cwd
+    shard_pipeline = step['pipeline']
+    if mode == 'sort':
+        shard_pipeline = shard_pipeline[:-1] + [without_sort_output(shard_pipeline[-1])]
+    returncodes = []
+    # Exit code of the pipeline of every shard, followed by the one of the merge
+    shard_returncodes = []
+    usages = []
+    shard_paths = []
+    launching = None
+    stdout = None
+    try:
+        with open(stdin_path, 'rb') as stdin, mmap.mmap(stdin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pipelines = []
+            feeders = []
+            try:
+                for start, end in line_chunks(data, shards):
+                    fd, shard_path = tempfile.mkstemp(prefix='.shard-', dir=output_dir)
+                    shard_paths.append(shard_path)
+                    pipeline = []
+                    pipelines.append(pipeline)
+                    with os.fdopen(fd, 'wb') as shard_output:
+                        launching = step['pipeline'][0][0]
+                        start_pipeline(shard_pipeline, subprocess.PIPE, shard_output, pipeline, cwd)
+                        launching = None
+                    feeder = threading.Thread(target=feed_shard, args=(pipeline[0].stdin, data, start, end))
+                    feeder.start()
+                    feeders.append(feeder)
+
+                for pipeline in pipelines:
+                    pipeline_returncodes = []
+                    for process in pipeline:
+                        returncode, usage = wait_process(process)
+                        pipeline_returncodes.append(returncode)
+                        if usage is not None:
+                            usages.append(usage)
+                    returncodes += pipeline_returncodes
+                    shard_returncodes.append(pipeline_returncode(pipeline_returncodes))
+            except OSError:
+                for pipeline in pipelines:
+                    for process in pipeline:
+                        process.kill()
+                        process.wait()
+                raise
+            finally:
+                for feeder in feeders:
+                    feeder.join()
+
+        if not any(shard_returncodes):
+            stdout = open(outputs[0], 'wb') if outputs else None
+            if mode == 'sort':
+                # Every shard is sorted already, the merge only has to interleave them
+                # and writes into the output file of the sort, if it has one
+                argv = step['pipeline'][-1]
+                launching = argv[0]
+                process = subprocess.Popen([expand_path(arg) for arg in [argv[0], '-m', *argv[1:]]] + shard_paths,
+                                           cwd=cwd, stdout=stdout)
+                launching = None
+                returncode, usage = wait_process(process)
+                returncodes.append(returncode)
+                shard_returncodes.append(returncode)
+                if usage is not None:
+                    usages.append(usage)
+            else:
+                for shard_path in shard_paths:
+                    with open(shard_path, 'rb') as shard_output:
+                        # Without a FileOutput the step writes to the stdout of the engine
+                        copy_fd(shard_output.fileno(), stdout.fileno() if stdout is not None else 1)
+    except OSError as e:
+        print(e)
+        returncodes.append(127 if launching is not None and isinstance(e, FileNotFoundError) else 1)
+        shard_returncodes.append(returncodes[-1])
+    finally:
+        if stdout is not None:
+            stdout.close()
+        for shard_path in shard_paths:
+            try:
+                os.remove(shard_path)
+            except FileNotFoundError:
+                pass
+
+    returncode = next((code for code in shard_returncodes if code != 0), 0)
+    if returncode == 0:
+        copy_outputs(outputs)
+    return {'returncode': returncode, 'returncodes': returncodes, 'usage': combine_usage(usages) if usages else None}
+
+
+"""
+    Every further FileOutput of the stream receives a copy of the first one
+"""
+def copy_outputs(outputs):
+    for output in outputs[1:]:
+        copy_file(outputs[0], output)
+
+
+"""
+    Executes a single step without a shell. The processes of the pipeline are
+    connected directly through OS pipes, the stdin of the first process is the
+    FileInput of the step and the stdout of the last process the first FileOutput.
+    Returns the exit code of every process of the pipeline, the step has failed
+    if any of them is not 0, together with the resource usage of the pipeline.
+    A line-parallel step is split into step['shards'] copies, as long as every
+    copy receives at least MIN_SHARD_SIZE bytes of its stdin.
+"""
+def run_step(step, cwd=None):
+    stdin_path = expand_path(step['stdin']) if step['stdin'] else None
+    outputs = [expand_path(path) for path in step['outputs']]
+    if cwd is not None:
+        outputs = [os.path.join(cwd, path) for path in outputs]
+        stdin_path = os.path.join(cwd, stdin_path) if stdin_path else None
+
+    mode = shard_mode(step)
+    if mode is not None and step.get('shards', 1) > 1:
+        try:
+            shards = min(step['shards'], os.path.getsize(stdin_path) // MIN_SHARD_SIZE)
+        except OSError:
+            shards = 1
+        if shards > 1:
+            return run_sharded_step(step, stdin_path, outputs, shards, mode, cwd)
+
+    returncodes = []
+    usages = []
+    processes = []
+    launching = None
+    stdin = stdout = None
+    try:
+        stdin = open(stdin_path, 'rb') if stdin_path else None
+        stdout = open(outputs[0], 'wb') if outputs else None
+
+        if not step['pipeline']:
+            # A FileInput which is directly connected to a FileOutput
+            if stdin is not None and stdout is not None:
+                copy_fd(stdin.fileno(), stdout.fileno())
+
+        launching = True
+        start_pipeline(step['pipeline'], stdin, stdout, processes, cwd)
+        launching = None
+        for process in processes:
+            returncode, usage = wait_process(process)
+            returncodes.append(returncode)
+            if usage is not None:
+                usages.append(usage)
+    except OSError as e:
+        print(e)
+        for process in processes:
+            process.kill()
+            process.wait()
+        # Same exit codes the shell uses for a missing tool or a missing file
+        returncodes.append(127 if launching is not None and isinstance(e, FileNotFoundError) else 1)
+    finally:
+        if stdin is not None:
+            stdin.close()
+        if stdout is not None:
+            stdout.close()
+
+    returncode = pipeline_returncode(returncodes)
+    if returncode == 0:
+        copy_outputs(outputs)
+    return {'returncode': returncode, 'returncodes': returncodes, 'usage': combine_usage(usages) if usages else None}
+
+
+"""
+    Entry point for process engines which have to report a failed step
+    through an exception (e.g. the PyTask of a Firework)
+"""
+def execute_step(step, cwd=None):
+    result = run_step(step, cwd)
+    if result['returncode'] != 0:
+        raise StepError(step, result)
+    return result
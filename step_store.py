@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import shutil
+
+from step_runner import execute_step, expand_path, run_step
+from workflow_status import write_json_atomic
+
+
+"""
+    Every argument of the pipeline could be a file the step reads or writes
+"""
+def candidate_files(step):
+    candidates = [step['stdin']] if step['stdin'] else []
+    for argv in step['pipeline']:
+        candidates += argv[1:]
+    candidates += step['outputs']
+    return list(dict.fromkeys(expand_path(path) for path in candidates))
+
+
+"""
+    State of a file used to detect changes, either its size and modification
+    time or a hash of its content. None if the path is not a file.
+"""
+def file_state(path, content_hash=False):
+    try:
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if not os.path.isfile(path):
+        return None
+    if not content_hash:
+        return [stat.st_size, stat.st_mtime_ns]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as input_file:
+        for chunk in iter(lambda: input_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+"""
+    Total size of the files which exist, used to report the output of a step
+"""
+def files_size(paths):
+    size = 0
+    for path in paths:
+        try:
+            size += os.path.getsize(path)
+        except OSError:
+            pass
+    return size
+
+
+def snapshot(step, content_hash=False):
+    return {path: file_state(path, content_hash) for path in candidate_files(step)}
+
+
+"""
+    Files which have been created or modified since the snapshot was taken,
+    the FileOutputs of the step are always part of them
+"""
+def changed_files(step, snapshot, content_hash=False):
+    outputs = {}
+    for path in candidate_files(step):
+        state = file_state(path, content_hash)
+        if state is not None and state != snapshot.get(path):
+            outputs[path] = state
+    for path in step['outputs']:
+        outputs[expand_path(path)] = file_state(expand_path(path), content_hash)
+    return outputs
+
+
+"""
+    Local store of the results of executed steps, used to skip steps whose
+    command line, tools and input files have not changed since their last
+    successful execution (similar to make).
+    Files are compared by their size and modification time, or by a hash of
+    their content if content_hash is set.
+    For every step the store keeps its fingerprint together with the state of
+    the files the step has written, in .step-store inside of the execution path.
+"""
+class StepStore:
+    def __init__(self, path, content_hash=False):
+        self.store_dir = f'{path}/.step-store'
+        self.content_hash = content_hash
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    @staticmethod
+    def step_key(step):
+        command = json.dumps([step['stdin'], step['pipeline'], step['outputs']])
+        return hashlib.sha256(command.encode()).hexdigest()
+
+    def file_state(self, path):
+        return file_state(path, self.content_hash)
+
+    def fingerprint(self, step, outputs):
+        digest = hashlib.sha256(self.step_key(step).encode())
+        for argv in step['pipeline']:
+            tool = shutil.which(expand_path(argv[0]))
+            digest.update(json.dumps([argv[0], tool and self.file_state(tool)]).encode())
+        for path in candidate_files(step):
+            if path not in outputs:
+                digest.update(json.dumps([path, self.file_state(path)]).encode())
+        return digest.hexdigest()
+
+    def _record_path(self, step):
+        return os.path.join(self.store_dir, f'{self.step_key(step)}.json')
+
+    def load(self, step):
+        try:
+            with open(self._record_path(step)) as record_file:
+                return json.load(record_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    """
+        A step is up to date if its fingerprint has not changed and all of the
+        files it has written are still in the state it left them in
+    """
+    def is_up_to_date(self, step):
+        record = self.load(step)
+        if record is None:
+            return False
+        outputs = record['outputs']
+        if any(self.file_state(path) != state for path, state in outputs.items()):
+            return False
+        return self.fingerprint(step, outputs) == record['fingerprint']
+
+    def snapshot(self, step):
+        return snapshot(step, self.content_hash)
+
+    """
+        Records a successful execution of the step, every file which has been
+        created or modified during the execution is an output of the step
+    """
+    def record(self, step, snapshot):
+        outputs = changed_files(step, snapshot, self.content_hash)
+        write_json_atomic(self._record_path(step), {'fingerprint': self.fingerprint(step, outputs), 'outputs': outputs})
+
+    """
+        Executes the step unless it is up to date. Steps which have to run
+        because one of the steps they depend on has been executed are forced.
+    """
+    def run_step(self, step, force=False):
+        if not force and self.is_up_to_date(step):
+            return {'returncode': 0, 'returncodes': [], 'skipped': True}
+
+        snapshot = self.snapshot(step)
+        result = run_step(step)
+        if result['returncode'] == 0:
+            self.record(step, snapshot)
+        return {**result, 'skipped': False}
+
+
+"""
+    Entry point for the PyTask of a Firework, see step_runner.execute_step
+"""
+def execute_incremental(step, path, content_hash=False):
+    store = StepStore(path, content_hash)
+    if store.is_up_to_date(step):
+        return {'returncode': 0, 'returncodes': [], 'skipped': True}
+
+    snapshot = store.snapshot(step)
+    result = execute_step(step)
+    store.record(step, snapshot)
+    return result
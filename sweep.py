@@ -0,0 +1,329 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shlex
+import subprocess
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from flow_to_cwl_parser import FlowToCWLParser, dump_document, expand_path, port_arguments
+from resources import record_resources
+from step_runner import redirected_output
+from tracing import Tracer
+from workflow_status import WorkFlowStatus, write_json_atomic
+
+
+MANIFEST_NAME = 'sweep-manifest.json'
+
+
+"""
+    Reads the table of overrides, either a CSV file with one column per input
+    or a JSON list of objects. Every row is one variant of the flow.
+"""
+def read_table(table_path):
+    with open(table_path, newline='') as table_file:
+        if table_path.endswith('.json'):
+            rows = json.load(table_file)
+        else:
+            rows = list(csv.DictReader(table_file))
+    if not rows:
+        raise ValueError(f'{table_path} does not contain any variants')
+    return rows
+
+
+"""
+    Executes the steps of a single variant inside of a worker process, the
+    variant directory is the working directory of its steps
+"""
+def run_local_variant(steps, variant_path, jobs=None):
+    from local_engine import LocalEngine
+    os.chdir(variant_path)
+    start = time.perf_counter()
+    with redirected_output('engine.log'):
+        LocalEngine(variant_path, None, jobs, steps=steps).execute()
+    return WorkFlowStatus(variant_path).getState(), time.perf_counter() - start
+
+
+"""
+    Runs a flow once for every row of a table of overrides. The flow is parsed
+    and compiled only once, a variant only replaces the values of the inputs
+    given in its row. The inputs are named like the inputs of the CWL workflow
+    of the flow: <step>_path for the path of a FileInput, <step>_outputFilePath
+    for the one of a FileOutput and <step>_<port> for the value of a port,
+    e.g. cat_path or awk_arg0.
+    Every variant is executed in a directory of its own inside of output_path.
+    The sweep reports every finished variant as a step to its own status and
+    writes the result of all variants into a single manifest.
+"""
+class Sweep:
+    def __init__(self, flow_file_path, variants, output_path, tracer=None):
+        self.tracer = tracer or Tracer('sweep', enabled=False)
+        self.flow_file_path = os.path.abspath(flow_file_path)
+        self.output_path = os.path.abspath(output_path)
+        with self.tracer.phase('compile'):
+            self.cwl_parser = FlowToCWLParser(flow_file_path, self.tracer)
+            self.cwl_parser.compile()
+        if self.cwl_parser.graph is None:
+            raise ValueError('A sweep changes the nodes of the flow, it needs the *.flow-File instead of its plan')
+        self.input_types = self.cwl_parser.workflow_definition(lambda idx: None)['inputs']
+
+        self.parameters = []
+        for overrides in variants:
+            for param in overrides:
+                if param not in self.cwl_parser.input_targets:
+                    raise ValueError(f'{param} is not an input of the flow, '
+                                   f'known inputs are {", ".join(self.cwl_parser.input_targets)}')
+                if param not in self.parameters:
+                    self.parameters.append(param)
+        self.variants = [{param: str(value) for param, value in overrides.items()} for overrides in variants]
+        self.state = WorkFlowStatus(self.output_path)
+
+    def variant_path(self, idx):
+        return os.path.join(self.output_path, f'variant-{idx:04d}')
+
+    """
+        Value of an override as the value of the node in the flow. The variants
+        are executed inside of their own directories, so the paths of FileInputs
+        are resolved relative to the current directory, all other relative paths
+        (e.g. of a FileOutput) are written into the directory of the variant.
+    """
+    def node_value(self, param, value):
+        node_id, port_index = self.cwl_parser.input_targets[param]
+        if self.cwl_parser.graph.nodes[node_id].kind == 'FileInput':
+            return os.path.abspath(expand_path(value))
+        if self.input_types[param] == 'boolean':
+            return value.lower() in ('true', '1', 'yes')
+        return value
+
+    """
+        Value of an override inside of the job order of the CWL workflow, the
+        runner is started in output_path, so every file is passed with its absolute path
+    """
+    def job_value(self, param, value):
+        input_type = self.input_types[param]
+        value = self.node_value(param, value)
+        if input_type == 'File':
+            return {'class': 'File', 'path': os.path.abspath(expand_path(value))}
+        if input_type in ('int', 'long'):
+            return int(value)
+        if input_type in ('float', 'double'):
+            return float(value)
+        if input_type == 'string[]':
+            return shlex.split(value)
+        return port_arguments(value)
+
+    """
+        Steps of a variant, grouped from the nodes of the compiled flow with the
+        overrides of the variant applied to them
+    """
+    def variant_steps(self, overrides):
+        graph = self.cwl_parser.graph
+        original = []
+        try:
+            for node in graph.nodes.values():
+                if node.kind == 'FileInput':
+                    original.append((node, 'path', node.path))
+                    node.path = os.path.abspath(expand_path(node.path))
+            for param, value in overrides.items():
+                node_id, port_index = self.cwl_parser.input_targets[param]
+                node = graph.nodes[node_id]
+                if port_index is None:
+                    original.append((node, 'path', node.path))
+                    node.path = self.node_value(param, value)
+                else:
+                    port = node.port('in', port_index)
+                    original.append((port, 'value', port.value))
+                    port.value = self.node_value(param, value)
+            return self.cwl_parser.flow_parser.group_steps()
+        finally:
+            for target, attribute, value in reversed(original):
+                setattr(target, attribute, value)
+
+    def start(self, variant_directories=True):
+        os.makedirs(self.output_path, exist_ok=True)
+        self.started = time.time()
+        self.state.start(len(self.variants))
+        for idx in range(len(self.variants) if variant_directories else 0):
+            os.makedirs(self.variant_path(idx), exist_ok=True)
+
+    def variant_finished(self, idx, state):
+        self.state.stepFinished(f'variant-{idx:04d}', 0 if state == 'FINISHED' else 1)
+
+    """
+        Executes at most concurrency variants at the same time with the Local
+        Process Engine, every variant runs its steps with up to jobs processes
+    """
+    def run_local(self, concurrency=None, jobs=1, shards=None):
+        self.start()
+        results = {}
+        with self.tracer.phase('variant_steps'):
+            variant_steps = [self.variant_steps(overrides) for overrides in self.variants]
+        if shards:
+            for steps in variant_steps:
+                for step in steps:
+                    step['shards'] = shards
+        with self.tracer.phase('execute', variants=len(self.variants)), \
+                ProcessPoolExecutor(max_workers=concurrency or os.cpu_count(),
+                                    mp_context=multiprocessing.get_context('spawn')) as pool:
+            futures = {}
+            for idx, steps in enumerate(variant_steps):
+                self.state.stepStarted(f'variant-{idx:04d}')
+                futures[pool.submit(run_local_variant, steps, self.variant_path(idx), jobs)] = idx
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    state, wall_time = future.result()
+                    results[idx] = {'state': state, 'wall_time': wall_time}
+                except Exception as e:
+                    results[idx] = {'state': 'ERROR', 'error': f'{type(e).__name__}: {e}'}
+                self.variant_finished(idx, results[idx]['state'])
+        return self.finish('local', results)
+
+    """
+        Executes all variants as a single CWL workflow scattering over the
+        overridden inputs. The runner decides how many variants run at once
+        (e.g. cwltool --parallel).
+    """
+    def run_cwl(self, cwl_engine='cwl-runner', runner=None):
+        # All variants are written into output_path by the runner
+        self.start(variant_directories=False)
+        base_job_order = self.cwl_parser.job_order()
+        job_order = {}
+        for param, value in base_job_order.items():
+            if isinstance(value, dict) and value.get('class') == 'File':
+                value = {**value, 'path': os.path.abspath(value['path'])}
+            job_order[param] = value
+        for param in self.parameters:
+            job_order[param] = [self.job_value(param, overrides[param]) if param in overrides
+                                else job_order[param] for overrides in self.variants]
+        document = self.cwl_parser.scatter_document(self.parameters)
+
+        start = time.perf_counter()
+        with self.tracer.phase('cwl_runner', variants=len(self.variants)):
+            if runner is not None:
+                returncode = runner.run(document, job_order, self.output_path)['returncode']
+            else:
+                workflow_path = os.path.join(self.output_path, f'{self.cwl_parser.name}-sweep.cwl')
+                params_path = os.path.join(self.output_path, f'{self.cwl_parser.name}-sweep-params.yml')
+                for path, data in ((workflow_path, document), (params_path, job_order)):
+                    with open(path, 'w') as output:
+                        dump_document(data, output)
+                with open(os.path.join(self.output_path, 'engine.log'), 'ab') as log:
+                    try:
+                        returncode = subprocess.run(shlex.split(cwl_engine) + [workflow_path, params_path],
+                                                    cwd=self.output_path, stdout=log, stderr=log).returncode
+                    except OSError as e:
+                        print(e)
+                        returncode = 127
+        wall_time = time.perf_counter() - start
+        # The scatter either succeeds or fails as a whole
+        state = 'FINISHED' if returncode == 0 else 'ERROR'
+        results = {}
+        for idx in range(len(self.variants)):
+            results[idx] = {'path': self.output_path, 'state': state, 'wall_time': wall_time}
+            self.variant_finished(idx, state)
+        return self.finish('cwl', results)
+
+    """
+        Inserts the workflows of all variants into the LaunchPad at once and
+        launches their Fireworks with `rockets` processes. The LaunchPad is not
+        reset, only the Fireworks of this sweep are launched.
+    """
+    def run_fireworks(self, db_connection, launchpad=None, rockets=1, in_memory=False):
+        from firework_engine import FireworkEngine, connect_launchpad, launch_workflows, workflow_completed
+
+        self.start()
+        sweep_id = uuid.uuid4().hex
+        engine = FireworkEngine(self.output_path, None, db_connection, steps=[], launchpad=launchpad)
+        lp = launchpad or connect_launchpad(db_connection, in_memory)
+        workflows = []
+        with self.tracer.phase('build_workflow', variants=len(self.variants)):
+            for idx, overrides in enumerate(self.variants):
+                steps = self.variant_steps(overrides)
+                path = self.variant_path(idx)
+                WorkFlowStatus(path).start(len(steps))
+                workflows.append(engine.workflow(f'{sweep_id}-{idx}', steps, path, cwd=path,
+                                                 spec={'sweep': sweep_id}))
+        launch_workflows(lp, workflows, rockets, self.tracer)
+
+        results = {}
+        for idx in range(len(self.variants)):
+            status = WorkFlowStatus(self.variant_path(idx))
+            state = 'FINISHED' if workflow_completed(status) else 'ERROR'
+            status.saveState(state)
+            record_resources(status)
+            results[idx] = {'state': state}
+            self.variant_finished(idx, state)
+        return self.finish('fireworks', results)
+
+    """
+        Writes the manifest with the overrides, the directory and the result of
+        every variant
+    """
+    def finish(self, engine, results):
+        variants = [{'variant': idx, 'path': self.variant_path(idx), 'overrides': overrides, **results[idx]}
+                    for idx, overrides in enumerate(self.variants)]
+        failed = sum(1 for variant in variants if variant['state'] != 'FINISHED')
+        manifest = {
+            'flow': self.flow_file_path,
+            'engine': engine,
+            'parameters': self.parameters,
+            'started': self.started,
+            'finished': time.time(),
+            'completed': len(variants) - failed,
+            'failed': failed,
+            'variants': variants
+        }
+        write_json_atomic(os.path.join(self.output_path, MANIFEST_NAME), manifest)
+        self.state.saveState('ERROR' if failed else 'FINISHED')
+        return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Execute a *.flow-File for every row of a table of overrides.')
+    parser.add_argument('-wf', metavar='Workflow Path', required=True)
+    parser.add_argument('-table', metavar='Table Path', required=True)
+    parser.add_argument('-o', metavar='Output Path', required=False, default='sweep')
+    parser.add_argument('-e', '--engine', choices=['local', 'cwl', 'fireworks'], required=False, default='local')
+    parser.add_argument('-n', '--concurrency', metavar='Variants', type=int, required=False, default=None)
+    parser.add_argument('-j', '--jobs', metavar='Jobs', type=int, required=False, default=1)
+    parser.add_argument('--shards', metavar='Shards', type=int, required=False, default=None)
+    parser.add_argument('-en', metavar='CWL-Engine', required=False, default='cwl-runner')
+    parser.add_argument('--inprocess', action='store_true')
+    parser.add_argument('-r', '--rockets', metavar='Rockets', type=int, required=False, default=1)
+    parser.add_argument('--mongomock', action='store_true')
+    parser.add_argument('-dbhost', metavar='DB Host', required=False, default=None)
+    parser.add_argument('-dbport', metavar='DB Port', type=int, required=False, default=None)
+    parser.add_argument('-dbname', metavar='DB Name', required=False, default=None)
+    parser.add_argument('-dbusername', metavar='DB Username', required=False, default=None)
+    parser.add_argument('-dbpassword', metavar='DB Password', required=False, default=None)
+    parser.add_argument('--trace', metavar='Trace Path', required=False, default=None)
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], required=False, default='json')
+    args = parser.parse_args(argv)
+
+    tracer = Tracer('sweep', enabled=args.trace is not None)
+    sweep = Sweep(args.wf, read_table(args.table), args.o, tracer)
+    if args.engine == 'local':
+        manifest = sweep.run_local(args.concurrency, args.jobs, args.shards)
+    elif args.engine == 'cwl':
+        from cwl_runner import shared_runner
+        manifest = sweep.run_cwl(args.en, shared_runner() if args.inprocess else None)
+    else:
+        manifest = sweep.run_fireworks({
+            "host": args.dbhost,
+            "port": args.dbport,
+            "name": args.dbname,
+            "username": args.dbusername,
+            "password": args.dbpassword
+        }, rockets=args.rockets, in_memory=args.mongomock)
+    if args.trace != None:
+        tracer.write(args.trace, args.trace_format)
+    print(f'{manifest["completed"]}/{len(manifest["variants"])} variants completed, '
+          f'see {os.path.join(sweep.output_path, MANIFEST_NAME)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+from cwl_cache import CWLCache
+from cwl_engine import CWLEngine
+from flow_generator import connection, tool_node
+from flow_to_cwl_parser import definitions_cache_key
+
+
+def write_flow(path, tool='sort'):
+    nodes = [{'id': '{in}', 'model': {'name': 'FileInput', 'path': 'in.txt'}}, tool_node('{tool}', tool, '-r', {}),
+             {'id': '{out}', 'model': {'name': 'FileOutput', 'outputFilePath': 'out.txt'}}]
+    connections = [connection('{in}', 1, '{tool}', 2), connection('{tool}', 1, '{out}', 3)]
+    path.write_text(json.dumps({'nodes': nodes, 'connections': connections}))
+    return str(path)
+
+
+def test_cache_hit_skips_generation(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    flow = write_flow(tmp_path / 'sort.flow')
+    cache = CWLCache(str(tmp_path / 'cache'))
+
+    first = CWLEngine(str(tmp_path), flow, 'cwl-runner', cache)
+    workflow, params, steps = first.cached_workflow_files()
+    assert first.cwl_parser is not None
+    first_params = open(params).read()
+    os.remove(params)
+
+    second = CWLEngine(str(tmp_path), flow, 'cwl-runner', cache)
+    assert second.cached_workflow_files() == (workflow, params, steps)
+    # The flow has neither been parsed nor generated again
+    assert second.cwl_parser is None
+    assert open(params).read() == first_params
+    assert steps == first.cwl_parser.steps
+
+
+def test_changed_flow_misses_the_cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = CWLCache(str(tmp_path / 'cache'))
+    flow = write_flow(tmp_path / 'tool.flow')
+    key = definitions_cache_key(flow)
+    assert key != definitions_cache_key(flow, fuse=True)
+    assert key != definitions_cache_key(flow, packed=True)
+    CWLEngine(str(tmp_path), flow, 'cwl-runner', cache).cached_workflow_files()
+
+    write_flow(tmp_path / 'tool.flow', tool='uniq')
+    assert definitions_cache_key(flow) != key
+    engine = CWLEngine(str(tmp_path), flow, 'cwl-runner', cache)
+    workflow = engine.cached_workflow_files()[0]
+    assert engine.cwl_parser is not None
+    entry_dir = os.path.dirname(workflow)
+    assert any('uniq' in open(os.path.join(entry_dir, name)).read() for name in os.listdir(entry_dir))
+    assert len(os.listdir(cache.cache_dir)) == 2
+
+
+def test_evicts_least_recently_used_entries(tmp_path):
+    cache = CWLCache(str(tmp_path), max_entries=2)
+    for key in ('a', 'b'):
+        cache.store(key, lambda entry_dir: None)
+    # a is used after b, so b is evicted first
+    os.utime(os.path.join(cache.cache_dir, 'b'), (time.time() - 60, time.time() - 60))
+    assert cache.lookup('a') is not None
+    cache.store('c', lambda entry_dir: None)
+    assert sorted(os.listdir(cache.cache_dir)) == ['a', 'c']
+    assert cache.lookup('b') is None
+
+
+def test_evicts_entries_older_than_max_age(tmp_path):
+    cache = CWLCache(str(tmp_path), max_age=3600)
+    cache.store('old', lambda entry_dir: None)
+    os.utime(os.path.join(cache.cache_dir, 'old'), (time.time() - 7200, time.time() - 7200))
+    cache.store('new', lambda entry_dir: None)
+    assert os.listdir(cache.cache_dir) == ['new']
@@ -0,0 +1,54 @@
+import json
+import sys
+
+from checkpoint import Checkpoints
+from cwl_engine import CWLEngine
+from flow_generator import connection, tool_node
+
+
+# Stands in for cwltool: executes the steps of the workflow in order and logs them
+# the way cwltool does, steps found in --cachedir are reused instead of executed.
+# The step named in FAIL_STEP fails.
+FAKE_RUNNER = '''
+import json, os, sys
+cache_dir = sys.argv[sys.argv.index('--cachedir') + 1] if '--cachedir' in sys.argv else None
+text = open(sys.argv[-2]).read()
+for step in json.loads(text[text.index('{'):])['steps']:
+    print(f'[step {step}] start', file=sys.stderr)
+    if cache_dir is None or not os.path.isdir(os.path.join(cache_dir, step)):
+        if step == os.environ.get('FAIL_STEP'):
+            print(f'[step {step}] completed permanentFail', file=sys.stderr)
+            sys.exit(1)
+        with open('executed.txt', 'a') as executed:
+            executed.write(step + '\\n')
+        if cache_dir is not None:
+            os.makedirs(os.path.join(cache_dir, step))
+    print(f'[step {step}] completed success', file=sys.stderr)
+'''
+
+
+def test_resume_reuses_the_steps_completed_before_the_failure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'runner.py').write_text(FAKE_RUNNER)
+    (tmp_path / 'in.txt').write_text('b\na\n')
+    nodes = [{'id': '{in}', 'model': {'name': 'FileInput', 'path': 'in.txt'}}, tool_node('{sort}', 'sort', '', {}),
+             {'id': '{out}', 'model': {'name': 'FileOutput', 'outputFilePath': 'out.txt'}}]
+    connections = [connection('{in}', 1, '{sort}', 2), connection('{sort}', 1, '{out}', 3)]
+    (tmp_path / 'sort.flow').write_text(json.dumps({'nodes': nodes, 'connections': connections}))
+    runner = f'{sys.executable} runner.py'
+
+    monkeypatch.setenv('FAIL_STEP', 'sort')
+    assert CWLEngine('.', 'sort.flow', runner).execute()['returncode'] == 1
+    checkpoints = Checkpoints('.').load_all()
+    assert (checkpoints['cat']['state'], checkpoints['sort']['state']) == ('COMPLETED', 'FAILED')
+
+    monkeypatch.delenv('FAIL_STEP')
+    (tmp_path / 'executed.txt').unlink()
+    assert CWLEngine('.', 'sort.flow', runner).execute(resume=True)['returncode'] == 0
+    # cat has completed before sort failed, so it is reused from the step cache
+    assert (tmp_path / 'executed.txt').read_text() == 'sort\nprint\n'
+
+    # A run without resume executes every step again
+    (tmp_path / 'executed.txt').unlink()
+    assert CWLEngine('.', 'sort.flow', runner).execute()['returncode'] == 0
+    assert (tmp_path / 'executed.txt').read_text() == 'cat\nsort\nprint\n'
@@ -0,0 +1,23 @@
+import json
+
+from firework_engine import FireworkEngine
+from flow_generator import connection, tool_node
+from workflow_status import WorkFlowStatus
+
+
+def test_incremental_run_skips_steps_with_relative_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'in.txt').write_text('b\na\n')
+    nodes = [{'id': '{in}', 'model': {'name': 'FileInput', 'path': 'in.txt'}}, tool_node('{sort}', 'sort', '', {}),
+             {'id': '{out}', 'model': {'name': 'FileOutput', 'outputFilePath': 'out.txt'}}]
+    connections = [connection('{in}', 1, '{sort}', 2), connection('{sort}', 1, '{out}', 3)]
+    (tmp_path / 'sort.flow').write_text(json.dumps({'nodes': nodes, 'connections': connections}))
+
+    for run in range(2):
+        engine = FireworkEngine('status', 'sort.flow', {}, incremental=True, in_memory=True)
+        engine.execute(f'sort-{run}')
+        # The steps run in the working directory of the engine, not in the launcher directories
+        assert (tmp_path / 'out.txt').read_text() == 'a\nb\n'
+    summary = WorkFlowStatus('status').getSummary()
+    assert summary['state'] == 'FINISHED'
+    assert summary['skipped'] == 1
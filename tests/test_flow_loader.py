@@ -0,0 +1,56 @@
+import json
+import os
+
+import pytest
+
+import flow_loader
+import flow_parser
+from flow_graph import FlowGraph
+from flow_parser import FlowParser
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = ['example_awk.flow', 'example_sort_cp.flow']
+
+
+def json_load_flow(input_file_path, chunk_size=None):
+    with open(input_file_path) as json_file:
+        return FlowGraph.from_json(json.load(json_file))
+
+
+"""
+    The example flow with everything the tokenizer has to get right: escaped
+    strings, numbers of every form and unused values holding brackets in strings
+"""
+def tricky_flow(path):
+    with open(os.path.join(ROOT, 'example_awk.flow')) as flow_file:
+        flow = json.load(flow_file)
+    for idx, node in enumerate(flow['nodes']):
+        node['position'] = {'x': -1.5e3, 'y': idx * 0.25, 'z': 0}
+        node['layout'] = {'label': 'a "quoted" ] } [ { label\\', 'sizes': [[1, 2.0], [], {}], 'hidden': None}
+        for port in node['model'].get('tool', {}).get('ports', []):
+            if isinstance(port.get('value'), str) and port['value']:
+                port['value'] += ' é\\t☃'
+    flow['version'] = {'numbers': [0, -0, 1E+2, 3.25e-1], 'flags': [True, False, None]}
+    with open(path, 'w') as flow_file:
+        # Escapes every non-ascii character, so the reader has to decode \uXXXX
+        json.dump(flow, flow_file, indent=1)
+    return path
+
+
+def parse_steps(path, monkeypatch, load):
+    monkeypatch.setattr(flow_parser, 'load_flow', load)
+    return FlowParser(path).parse_steps()
+
+
+@pytest.mark.parametrize('chunk_size', [7, 64 * 1024])
+@pytest.mark.parametrize('example', EXAMPLES + ['tricky'])
+def test_same_steps_as_json_load(example, chunk_size, monkeypatch, tmp_path):
+    if example == 'tricky':
+        path = tricky_flow(str(tmp_path / 'tricky.flow'))
+    else:
+        path = os.path.join(ROOT, example)
+    expected = parse_steps(path, monkeypatch, json_load_flow)
+    steps = parse_steps(path, monkeypatch, lambda path: flow_loader.load_flow(path, chunk_size))
+    assert steps == expected
+    assert steps
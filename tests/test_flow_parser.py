@@ -0,0 +1,54 @@
+import json
+
+from flow_generator import connection, tool_node
+from flow_parser import FlowParser
+
+
+def file_input(node_id, path):
+    return {'id': node_id, 'model': {'name': 'FileInput', 'path': path}}
+
+
+def file_output(node_id, path):
+    return {'id': node_id, 'model': {'name': 'FileOutput', 'outputFilePath': path}}
+
+
+def parse_steps(tmp_path, nodes, connections):
+    path = tmp_path / 'fan.flow'
+    path.write_text(json.dumps({'nodes': nodes, 'connections': connections}))
+    return [(step['command'], step['stdin'], step['outputs'], step['depends_on'])
+            for step in FlowParser(str(path)).parse_steps()]
+
+
+def test_file_output_in_the_middle_of_a_pipeline(tmp_path):
+    nodes = [file_input('{in}', 'in.txt'), tool_node('{sort}', 'sort', '-r', {}), tool_node('{wc}', 'wc', '-l', {}),
+             file_output('{sorted}', 'sorted.txt'), file_output('{count}', 'count.txt')]
+    connections = [connection('{in}', 1, '{sort}', 2), connection('{sort}', 1, '{wc}', 2),
+                   connection('{sort}', 1, '{sorted}', 3), connection('{wc}', 1, '{count}', 3)]
+    assert parse_steps(tmp_path, nodes, connections) == [
+        ('cat in.txt | sort -r  > sorted.txt', 'in.txt', ['sorted.txt'], []),
+        ('cat sorted.txt | wc -l  > count.txt', 'sorted.txt', ['count.txt'], [0]),
+    ]
+
+
+def test_tool_read_by_several_tools(tmp_path):
+    nodes = [file_input('{in}', 'in.txt'), tool_node('{sort}', 'sort', '-r', {}), tool_node('{wc}', 'wc', '-l', {}),
+             tool_node('{head}', 'head', '-n1', {}), file_output('{count}', 'count.txt')]
+    connections = [connection('{in}', 1, '{sort}', 2), connection('{sort}', 1, '{wc}', 2),
+                   connection('{sort}', 1, '{head}', 2), connection('{wc}', 1, '{count}', 3)]
+    assert parse_steps(tmp_path, nodes, connections) == [
+        ('cat in.txt | sort -r  > .stream-sort', 'in.txt', ['.stream-sort'], []),
+        ('cat .stream-sort | wc -l  > count.txt', '.stream-sort', ['count.txt'], [0]),
+        ('cat .stream-sort | head -n1 ', '.stream-sort', [], [0]),
+    ]
+
+
+def test_file_read_by_several_tools(tmp_path):
+    nodes = [file_input('{in}', 'in.txt'), tool_node('{sort}', 'sort', '-r', {}), tool_node('{wc}', 'wc', '-l', {}),
+             file_output('{sorted}', 'a.txt'), file_output('{count}', 'b.txt')]
+    connections = [connection('{in}', 1, '{sort}', 2), connection('{in}', 1, '{wc}', 2),
+                   connection('{sort}', 1, '{sorted}', 3), connection('{wc}', 1, '{count}', 3)]
+    # Both branches only read the file, so they run independently of each other
+    assert parse_steps(tmp_path, nodes, connections) == [
+        ('cat in.txt | sort -r  > a.txt', 'in.txt', ['a.txt'], []),
+        ('cat in.txt | wc -l  > b.txt', 'in.txt', ['b.txt'], []),
+    ]
@@ -0,0 +1,52 @@
+import json
+import shlex
+import subprocess
+
+from flow_generator import connection, tool_node
+from flow_to_cwl_parser import FlowToCWLParser
+
+
+"""
+    Shell command of a tool with ShellCommandRequirement, built the way a CWL
+    runner builds it: arguments and bound inputs ordered by their position,
+    quoted unless shellQuote is false
+"""
+def shell_command(tool, job_order):
+    bindings = [(argument['position'], argument['valueFrom'].replace('\\$(', '$('),
+                 argument.get('shellQuote', True)) for argument in tool['arguments']]
+    for name, definition in tool['inputs'].items():
+        if 'inputBinding' in definition:
+            bindings.append((definition['inputBinding']['position'], job_order[name]['path'], True))
+    return ' '.join(shlex.quote(value) if quote else value for _, value, quote in sorted(bindings))
+
+
+def run_fused(tmp_path, tools):
+    nodes = [{'id': '{in}', 'model': {'name': 'FileInput', 'path': 'in.txt'}},
+             {'id': '{out}', 'model': {'name': 'FileOutput', 'outputFilePath': 'out.txt'}}]
+    connections = []
+    source = '{in}'
+    for idx, tool in enumerate(tools):
+        nodes.append(tool_node(f'{{tool{idx}}}', tool, '', {}))
+        connections.append(connection(source, 1, f'{{tool{idx}}}', 2))
+        source = f'{{tool{idx}}}'
+    connections.append(connection(source, 1, '{out}', 3))
+    (tmp_path / 'pipe.flow').write_text(json.dumps({'nodes': nodes, 'connections': connections}))
+    (tmp_path / 'in.txt').write_text('b\na\n')
+
+    parser = FlowToCWLParser(str(tmp_path / 'pipe.flow'), fuse=True)
+    parser.compile()
+    tool = parser.tool_definition(0)
+    assert 'ShellCommandRequirement' in json.dumps(tool)
+    return subprocess.run(['/bin/sh', '-c', shell_command(tool, parser.job_order())], cwd=tmp_path,
+                          capture_output=True, text=True)
+
+
+def test_fused_pipeline_streams_through_all_tools(tmp_path):
+    result = run_fused(tmp_path, ['sort', 'uniq'])
+    assert (result.returncode, result.stdout) == (0, 'a\nb\n')
+
+
+def test_fused_pipeline_fails_if_the_first_tool_fails(tmp_path):
+    assert run_fused(tmp_path, ['false', 'sort', 'uniq']).returncode != 0
+    assert run_fused(tmp_path, ['sort', 'false', 'uniq']).returncode != 0
+    assert run_fused(tmp_path, ['sort', 'false']).returncode != 0
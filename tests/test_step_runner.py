@@ -0,0 +1,59 @@
+from step_runner import line_chunks, run_sharded_step, run_step, without_sort_output
+
+
+def test_without_sort_output():
+    assert without_sort_output(['sort', '-r', '-o', 'out.txt', 'in.txt']) == ['sort', '-r', 'in.txt']
+    assert without_sort_output(['sort', '-oout.txt', '-r']) == ['sort', '-r']
+    assert without_sort_output(['sort', '-ro', 'out.txt']) == ['sort', '-r']
+    assert without_sort_output(['sort', '--output=out.txt', '-n']) == ['sort', '-n']
+    assert without_sort_output(['sort', '--out', 'out.txt']) == ['sort']
+    # Values of other options are never taken for the output
+    assert without_sort_output(['sort', '-t', 'o', '-k', '2']) == ['sort', '-t', 'o', '-k', '2']
+    assert without_sort_output(['sort', '--', '-o']) == ['sort', '--', '-o']
+
+
+def test_line_chunks():
+    data = b'a\nbb\nccc\ndddd\n'
+    chunks = line_chunks(data, 3)
+    assert b''.join(data[start:end] for start, end in chunks) == data
+    assert all(data[end - 1:end] == b'\n' for _, end in chunks)
+    # The last line does not need a trailing newline
+    assert line_chunks(b'a\nb\nc', 2) == [(0, 4), (4, 5)]
+    # Never more chunks than lines
+    assert line_chunks(b'a\nb\n', 8) == [(0, 2), (2, 4)]
+    assert line_chunks(b'', 4) == [(0, 0)]
+
+
+def sharded_and_unsharded(tmp_path, pipeline, parallel, outputs):
+    (tmp_path / 'in.txt').write_text(''.join(f'{value * 7919 % 1000}\n' for value in range(5000)))
+    step = {'stdin': 'in.txt', 'pipeline': pipeline, 'parallel': parallel, 'outputs': outputs}
+    results = []
+    for shards in (1, 4):
+        if shards == 1:
+            assert run_step(step, str(tmp_path))['returncode'] == 0
+        else:
+            result = run_sharded_step(step, str(tmp_path / 'in.txt'),
+                                      [str(tmp_path / path) for path in outputs], shards, parallel[-1], str(tmp_path))
+            assert result['returncode'] == 0
+            # Every shard runs its own pipeline
+            assert len(result['returncodes']) >= shards * len(pipeline)
+        results.append((tmp_path / (outputs or ['sorted.txt'])[0]).read_text())
+    assert not list(tmp_path.glob('.shard-*'))
+    return results
+
+
+def test_sharded_lines_output_matches_unsharded(tmp_path):
+    unsharded, sharded = sharded_and_unsharded(tmp_path, [['grep', '7']], ['lines'], ['out.txt'])
+    assert sharded == unsharded
+
+
+def test_sharded_sort_output_matches_unsharded(tmp_path):
+    unsharded, sharded = sharded_and_unsharded(tmp_path, [['grep', '-v', '5'], ['sort', '-n']], ['lines', 'sort'],
+                                               ['out.txt'])
+    assert sharded == unsharded
+
+
+def test_sharded_sort_writes_its_output_file_once(tmp_path):
+    unsharded, sharded = sharded_and_unsharded(tmp_path, [['sort', '-r', '-o', 'sorted.txt']], ['sort'], [])
+    assert sharded == unsharded
+    assert sharded.splitlines() == sorted((tmp_path / 'in.txt').read_text().splitlines(), reverse=True)
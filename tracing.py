@@ -0,0 +1,179 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+"""
+    Bytes read and written by a process, including all of its children which
+    have already been waited for. Only available on Linux, None otherwise.
+"""
+def io_counters(pid='self'):
+    try:
+        with open(f'/proc/{pid}/io') as io_file:
+            counters = dict(line.split(': ') for line in io_file.read().splitlines())
+    except (OSError, ValueError):
+        return None
+    return {'read_bytes': int(counters['rchar']), 'write_bytes': int(counters['wchar'])}
+
+
+"""
+    Resource usage of this process together with all of its waited for children
+"""
+def process_usage():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {
+        'cpu': own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        'max_rss': max(own.ru_maxrss, children.ru_maxrss) * RSS_UNIT,
+        'read_bytes': None,
+        'write_bytes': None
+    }
+    usage.update(io_counters() or {})
+    return usage
+
+
+"""
+    Resource usage of a finished process, see step_runner.wait_process. The peak
+    RSS of a process includes the peak RSS of the engine it has been forked from,
+    which the kernel carries over the exec of the tool. Only a larger peak is the
+    one of the tool itself, otherwise the peak of the tool is unknown (None).
+"""
+def child_usage(rusage, io=None):
+    inherited = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'cpu': rusage.ru_utime + rusage.ru_stime,
+        'max_rss': rusage.ru_maxrss * RSS_UNIT if rusage.ru_maxrss > inherited else None,
+        'read_bytes': io and io['read_bytes'],
+        'write_bytes': io and io['write_bytes']
+    }
+
+
+"""
+    Combines the usage of the processes of a pipeline, which run at the same time.
+    Processes whose peak RSS is unknown are left out of it.
+"""
+def combine_usage(usages):
+    def total(key):
+        values = [usage[key] for usage in usages if usage[key] is not None]
+        return sum(values) if values else None
+
+    return {
+        'cpu': sum(usage['cpu'] for usage in usages),
+        'max_rss': total('max_rss'),
+        'read_bytes': total('read_bytes'),
+        'write_bytes': total('write_bytes')
+    }
+
+
+"""
+    Records the phases of a workflow run (parsing, generating the CWL files,
+    starting the runner, round trips to the LaunchPad, ...) and its steps as
+    spans with their wall time, CPU time, peak RSS and the bytes read and written.
+    Phases are measured for the whole process, as they run one after another,
+    while the usage of a step is measured for its own processes only.
+    A disabled tracer records nothing, so the engines can always use one.
+    The spans can be exported as JSON or in the trace event format of Chrome
+    (chrome://tracing, Perfetto).
+"""
+class Tracer:
+    def __init__(self, name='workflow', enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.origin = time.time()
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, name, category, start, end, usage=None, **args):
+        if not self.enabled:
+            return
+        span = {
+            'name': name, 'category': category, 'start': start - self.origin,
+            'wall': end - start, 'thread': threading.get_ident(), **(usage or {})
+        }
+        if args:
+            span['args'] = args
+        with self.lock:
+            self.spans.append(span)
+
+    """
+        Measures the block of the with statement as a phase. The yielded dict can
+        be used to add further information to the span.
+    """
+    @contextmanager
+    def phase(self, name, **args):
+        if not self.enabled:
+            yield args
+            return
+        before = process_usage()
+        start = time.time()
+        try:
+            yield args
+        finally:
+            end = time.time()
+            after = process_usage()
+            usage = {'cpu': after['cpu'] - before['cpu'], 'max_rss': after['max_rss']}
+            for key in ('read_bytes', 'write_bytes'):
+                usage[key] = after[key] - before[key] if after[key] is not None else None
+            self.add_span(name, 'phase', start, end, usage, **args)
+
+    def step(self, name, start, end, usage=None, **args):
+        self.add_span(name, 'step', start, end, usage, **args)
+
+    """
+        Adds the steps recorded in the journal of a workflow run since the given
+        time, used for steps which have not been executed by this process
+    """
+    def steps_from_journal(self, events, since):
+        started = {}
+        for event in events:
+            if event['time'] < since:
+                continue
+            if event['event'] == 'step_started':
+                started[event['step']] = event['time']
+            elif event['event'] == 'step_finished' and event['step'] in started:
+                self.step(event['step'], started.pop(event['step']), event['time'], event.get('usage'),
+                          exit_code=event['exit_code'], output_bytes=event['output_bytes'])
+
+    def report(self):
+        totals = {}
+        for category in ('phase', 'step'):
+            spans = [span for span in self.spans if span['category'] == category]
+            totals[category] = {
+                'count': len(spans),
+                'wall': sum(span['wall'] for span in spans),
+                'cpu': sum(span.get('cpu') or 0 for span in spans),
+                'max_rss': max((span.get('max_rss') or 0 for span in spans), default=0),
+                'read_bytes': sum(span.get('read_bytes') or 0 for span in spans),
+                'write_bytes': sum(span.get('write_bytes') or 0 for span in spans)
+            }
+        return {'engine': self.name, 'origin': self.origin, 'spans': self.spans, 'totals': totals}
+
+    def chrome_trace(self):
+        threads = {}
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': os.getpid(), 'args': {'name': self.name}}]
+        for span in sorted(self.spans, key=lambda span: span['start']):
+            tid = threads.setdefault(span['thread'], len(threads))
+            args = {key: value for key, value in span.items()
+                    if key in ('cpu', 'max_rss', 'read_bytes', 'write_bytes') and value is not None}
+            args.update(span.get('args', {}))
+            events.append({
+                'name': span['name'], 'cat': span['category'], 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                'ts': span['start'] * 1e6, 'dur': span['wall'] * 1e6, 'args': args
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    """
+        Writes the spans to the file, format is either 'json' or 'chrome'
+    """
+    def write(self, file_path, format='json'):
+        data = self.chrome_trace() if format == 'chrome' else self.report()
+        with open(file_path, 'w') as trace_file:
+            json.dump(data, trace_file, indent=1)
@@ -0,0 +1,166 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+"""
+    Writes the file under a temporary name first and renames it afterwards,
+    so a reader either sees the previous or the new content, never a partial file
+"""
+def write_json_atomic(file_path, data):
+    tmp_path = f'{file_path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'w') as out_file:
+        json.dump(data, out_file)
+    os.replace(tmp_path, file_path)
+
+
+"""
+    Status of a workflow run inside of its execution path. Every change is
+    appended as an event to the journal (.workflow-journal.jsonl), while the
+    summary (.workflow-status.json) always holds the current state and the
+    number of steps in each state. The summary is small and replaced atomically,
+    so it can be polled in constant time without reading the journal.
+    The resources the steps have used in the latest run of each command are kept
+    in .workflow-resources.json the same way (see resources.record_resources).
+    Steps may report their progress from several threads or processes,
+    updates of the summary are serialized through a lock file.
+"""
+class WorkFlowStatus:
+    def __init__(self, path):
+        self.file_path = f'{path}/.workflow-status.json'
+        self.journal_path = f'{path}/.workflow-journal.jsonl'
+        self.lock_path = f'{path}/.workflow-status.lock'
+        self.resources_path = f'{path}/.workflow-resources.json'
+
+    def _append_event(self, event):
+        line = json.dumps({'time': time.time(), **event}) + '\n'
+        # A single write on a file opened for appending is never interleaved with other writers
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _update_summary(self, update):
+        with self._locked():
+            try:
+                summary = self.getSummary()
+            except (FileNotFoundError, ValueError):
+                summary = {'state': None}
+            update(summary)
+            summary['updated'] = time.time()
+            write_json_atomic(self.file_path, summary)
+
+    def saveState(self, state):
+        self._append_event({'event': 'state', 'state': state})
+
+        def update(summary):
+            summary['state'] = state
+        self._update_summary(update)
+
+        return True
+
+    """
+        Starts a new run of the workflow, resetting the step counters of the summary.
+        The summary remembers where the events of the run start in the journal.
+    """
+    def start(self, total_steps, reused_steps=0):
+        try:
+            journal_offset = os.path.getsize(self.journal_path)
+        except FileNotFoundError:
+            journal_offset = 0
+        self._append_event({'event': 'start', 'steps': total_steps, 'reused': reused_steps})
+
+        def update(summary):
+            summary.clear()
+            summary.update({
+                'state': 'RUNNING', 'started': time.time(), 'total': total_steps,
+                'running': 0, 'completed': reused_steps, 'failed': 0, 'skipped': reused_steps,
+                'output_bytes': 0, 'journal_offset': journal_offset
+            })
+        self._update_summary(update)
+
+    def stepStarted(self, step, command=None):
+        event = {'event': 'step_started', 'step': step}
+        # Identifies the step across runs, see resources.measured_resources
+        if command is not None:
+            event['command'] = command
+        self._append_event(event)
+
+        def update(summary):
+            summary['running'] = summary.get('running', 0) + 1
+        self._update_summary(update)
+
+    def stepFinished(self, step, exit_code, output_bytes=0, skipped=False, usage=None):
+        event = {'event': 'step_finished', 'step': step, 'exit_code': exit_code,
+                 'output_bytes': output_bytes, 'skipped': skipped}
+        # Resource usage of the processes of the step, see tracing.Tracer
+        if usage is not None:
+            event['usage'] = usage
+        self._append_event(event)
+
+        def update(summary):
+            summary['running'] = max(summary.get('running', 0) - 1, 0)
+            if exit_code == 0:
+                summary['completed'] = summary.get('completed', 0) + 1
+            else:
+                summary['failed'] = summary.get('failed', 0) + 1
+            if skipped:
+                summary['skipped'] = summary.get('skipped', 0) + 1
+            summary['output_bytes'] = summary.get('output_bytes', 0) + output_bytes
+        self._update_summary(update)
+
+    def getState(self):
+        return self.getSummary()['state']
+
+    def getSummary(self):
+        with open(self.file_path) as json_file:
+            summary = json.load(json_file)
+        # Status files written by earlier versions only contain the state
+        if not isinstance(summary, dict):
+            summary = {'state': summary}
+        return summary
+
+    def describe(self):
+        return json.dumps(self.getSummary())
+
+    """
+        All events of the journal from the given byte offset on, oldest first
+    """
+    def events(self, offset=0):
+        with open(self.journal_path, 'rb') as journal_file:
+            journal_file.seek(offset)
+            for line in journal_file:
+                if line.endswith(b'\n'):
+                    yield json.loads(line)
+
+    """
+        Events of the latest run, the journal before it is not read at all
+    """
+    def runEvents(self):
+        return self.events(self.getSummary().get('journal_offset', 0))
+
+    """
+        Resources used by the steps, indexed by their command (see resources.measured_resources)
+    """
+    def getResources(self):
+        try:
+            with open(self.resources_path) as json_file:
+                return json.load(json_file)
+        except FileNotFoundError:
+            return {}
+
+    def saveResources(self, measured):
+        with self._locked():
+            resources = self.getResources()
+            resources.update(measured)
+            write_json_atomic(self.resources_path, resources)